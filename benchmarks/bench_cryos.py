@@ -0,0 +1,264 @@
+"""
+Benchmark the overhead and accuracy of the Cryos pipeline
+
+Every phase runs in a fresh child process, so its wall time, CPU seconds and
+peak RSS are its own. A local stand-in server (``cryos serve``) runs in a
+separate process for each shaped link speed, so the server's work is not
+billed to the tool. Results are written as JSON for comparison between versions.
+
+    python benchmarks/bench_cryos.py --rates 10 50 200 --output bench_results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# Phase bodies, run inside the child process. Each takes the parsed options
+# and returns a dict of extra fields (bytes moved, measured values, ...)
+
+def phase_import_core(options):
+    import cryos.runner  # noqa: F401
+    import cryos.suitability  # noqa: F401
+    return {}
+
+
+def phase_import_app(options):
+    # Executes the whole Streamlit script once, the way a page load does
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(os.path.join(ROOT, "cryos_speed_wavy.py"), default_timeout=60)
+    app.run()
+    return {"exception": bool(app.exception)}
+
+
+def _discovery(options, warm):
+    import tempfile
+    from urllib.parse import urlparse
+    from cryos.servers import ServerSelector
+    parts = urlparse(options.server_url)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        selector = ServerSelector(f"{parts.scheme}://{parts.netloc}", cache_dir=cache_dir)
+        if warm:
+            selector.best()
+        # Only the selection itself is timed, not the setup above
+        start = time.perf_counter()
+        server = selector.best()
+        return {"selection_s": time.perf_counter() - start, "cached": server["cached"],
+                "latency": server["latency"]}
+
+
+def phase_discovery_cold(options):
+    return _discovery(options, warm=False)
+
+
+def phase_discovery_warm(options):
+    return _discovery(options, warm=True)
+
+
+def phase_latency(options):
+    from cryos.latency import probe_latency
+    from cryos.runner import server_from_url
+    result = probe_latency(server_from_url(options.server_url), num_probes=options.pings)
+    return {"ping": result["mean"], "jitter": result["jitter"], "loss": result["loss"],
+            "expected_ping": options.latency}
+
+
+def _throughput(options, direction):
+    from cryos.runner import server_from_url
+    from cryos.throughput import measure_throughput
+    result = measure_throughput(server_from_url(options.server_url), direction,
+                                streams=options.streams, duration=options.duration,
+                                warmup=options.warmup)
+    return {"mbps": result["mbps"], "bytes": result["bytes"], "expected_mbps": options.rate,
+            "error": (result["mbps"] - options.rate) / options.rate}
+
+
+def phase_download(options):
+    return _throughput(options, "download")
+
+
+def phase_upload(options):
+    return _throughput(options, "upload")
+
+
+def _gauges(options, vary):
+    from cryos.render import create_speedometer
+    # The four gauges one results render builds
+    scale = ["rgba(150, 50, 0, 0.8)", "rgba(0, 100, 150, 0.8)", "rgba(0, 150, 200, 0.8)"]
+    for i in range(options.renders):
+        # New values each render miss the figure cache, as after a new test;
+        # the same values hit it, as on a rerun with unchanged results
+        step = i * 0.01 if vary else 0.0
+        create_speedometer(87.5 + step, 131.25, "Download", "Mbps", scale)
+        create_speedometer(23.4 + step, 50, "Upload", "Mbps", scale)
+        create_speedometer(18.2 + step, 150, "Ping", "ms", scale, is_inverse=True)
+        create_speedometer(2.1 + step, 30, "Jitter", "ms", scale, is_inverse=True)
+    return {"renders": options.renders}
+
+
+def phase_gauges(options):
+    return _gauges(options, vary=True)
+
+
+def phase_gauges_cached(options):
+    return _gauges(options, vary=False)
+
+
+def phase_suitability(options):
+    from cryos.render import create_use_case_card
+    from cryos.suitability import analyze, build_suggestions
+    result = {"download": 87.5, "upload": 23.4, "ping": 18.2, "jitter": 2.1}
+    for _ in range(options.renders):
+        cards = [create_use_case_card(case["title"], case["icon"], case["status"], case["message"])
+                 for case in analyze(result)]
+        build_suggestions(result)
+    return {"renders": options.renders, "cards": len(cards)}
+
+
+PHASES = {
+    "import_core": (phase_import_core, False),
+    "import_app": (phase_import_app, False),
+    "discovery_cold": (phase_discovery_cold, True),
+    "discovery_warm": (phase_discovery_warm, True),
+    "latency": (phase_latency, True),
+    "download": (phase_download, True),
+    "upload": (phase_upload, True),
+    "gauges": (phase_gauges, False),
+    "gauges_cached": (phase_gauges_cached, False),
+    "suitability": (phase_suitability, False),
+}
+
+
+def run_child(options):
+    """
+    Run one phase in this process and print its measurements as JSON
+    """
+    body, _ = PHASES[options.phase]
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    extra = body(options)
+    measurement = {
+        "wall_s": time.perf_counter() - wall_start,
+        "cpu_s": time.process_time() - cpu_start,
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        // (1024 if sys.platform == "darwin" else 1),
+    }
+    measurement.update(extra)
+    print(json.dumps(measurement))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(rate, latency, jitter):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "cryos", "serve", "--port", str(port),
+         "--download-mbps", str(rate), "--upload-mbps", str(rate),
+         "--latency", str(latency), "--jitter", str(jitter)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}/speedtest/upload.php"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("local speedtest server did not start")
+
+
+def run_phase(phase, options, server_url=None, rate=None):
+    command = [sys.executable, os.path.abspath(__file__), "--phase", phase,
+               "--pings", str(options.pings), "--streams", str(options.streams),
+               "--duration", str(options.duration), "--warmup", str(options.warmup),
+               "--renders", str(options.renders), "--latency", str(options.latency)]
+    if server_url:
+        command += ["--server-url", server_url, "--rate", str(rate)]
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"phase": phase, "rate_mbps": rate, "failed": completed.stderr.strip().splitlines()[-1:]}
+    measurement = json.loads(completed.stdout.strip().splitlines()[-1])
+    measurement.update(phase=phase, rate_mbps=rate)
+    return measurement
+
+
+def run_suite(options):
+    results = []
+    selected = options.phases or list(PHASES)
+    for phase in selected:
+        if PHASES[phase][1]:
+            continue
+        for _ in range(options.repeat):
+            results.append(run_phase(phase, options))
+            print(f"{phase}: {results[-1]}", file=sys.stderr)
+
+    for rate in options.rates:
+        server, server_url = start_server(rate, options.latency, options.jitter)
+        try:
+            for phase in selected:
+                if not PHASES[phase][1]:
+                    continue
+                for _ in range(options.repeat):
+                    results.append(run_phase(phase, options, server_url, rate))
+                    print(f"{phase} @ {rate} Mbps: {results[-1]}", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {key: getattr(options, key) for key in
+                    ("rates", "latency", "jitter", "pings", "streams", "duration", "warmup", "renders",
+                     "repeat")},
+        "results": results,
+    }
+    with open(options.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} measurements to {options.output}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--phases", nargs="+", choices=list(PHASES), help="phases to run (default: all)")
+    parser.add_argument("--rates", nargs="+", type=float, default=[10.0, 50.0, 200.0],
+                        help="shaped link speeds in Mbps (default: 10 50 200)")
+    parser.add_argument("--latency", type=float, default=20.0, help="added server latency in ms")
+    parser.add_argument("--jitter", type=float, default=2.0, help="added server jitter in ms")
+    parser.add_argument("--pings", type=int, default=20)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--renders", type=int, default=20, help="renders per gauges and suitability phase")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per phase and rate")
+    parser.add_argument("--output", default="bench_results.json")
+    # Used by the child processes
+    parser.add_argument("--phase", choices=list(PHASES), help=argparse.SUPPRESS)
+    parser.add_argument("--server-url", help=argparse.SUPPRESS)
+    parser.add_argument("--rate", type=float, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.phase:
+        run_child(options)
+    else:
+        run_suite(options)
+
+
+if __name__ == "__main__":
+    main()
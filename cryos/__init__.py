@@ -0,0 +1,24 @@
+"""
+Cryos core: network measurement and suitability analysis without any UI
+The Streamlit app and the ``cryos`` command line tool are both built on this package
+"""
+
+__version__ = "0.2.0"
+
+from cryos.latency import measure_jitter, probe_latency
+from cryos.realtime import simulate_stream
+from cryos.runner import run_speed_test
+from cryos.throughput import measure_throughput
+from cryos.suitability import USE_CASES, analyze, build_suggestions, get_status
+
+__all__ = [
+    "USE_CASES",
+    "analyze",
+    "build_suggestions",
+    "get_status",
+    "measure_jitter",
+    "probe_latency",
+    "measure_throughput",
+    "run_speed_test",
+    "simulate_stream",
+]
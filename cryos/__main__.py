@@ -0,0 +1,5 @@
+import sys
+
+from cryos.cli import main
+
+sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Compact binary archive of runs and their raw samples, for keeping many more
+runs than JSON history rows allow
+An archive is a header followed by one record per run: the run's summary as
+JSON, then each sample series as a typed array block (little endian, 8 byte
+aligned, integers in the narrowest type that holds them). Timestamps are
+delta encoded, and the summary and blocks can be zlib compressed.
+Records are appended one at a time, so writers stream; the reader memory maps
+the file and hands out uncompressed plain series as memoryviews into the map
+without copying them
+"""
+
+import copy
+import itertools
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+from cryos.history import METRIC_COLUMNS
+from cryos.suitability import analyze
+
+MAGIC = b"CRYOSARC"
+VERSION = 1
+
+# Magic, version and 6 reserved bytes
+FILE_HEADER = struct.Struct("<8sH6x")
+# Length of the record body that follows and of its JSON summary, flags
+RECORD_HEADER = struct.Struct("<QIB3x")
+SUMMARY_ZLIB = 1
+
+ALIGN = 8
+
+# Series stored per transfer direction: interval end times in microseconds
+# (delta encoded, the steps are near constant) and bytes moved per interval
+TRANSFER_SERIES = (("t", "q", "delta"), ("bytes", "q", "plain"))
+
+# Integer storage types, narrowest first
+INTEGER_TYPES = ("b", "h", "i", "q")
+
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _pad(n):
+    return -n % ALIGN
+
+
+def _encode(values, typecode, encoding, compress):
+    """
+    One series as (stored typecode, block bytes); only integer ("q") series
+    are delta encoded and narrowed
+    """
+    data = array(typecode, values)
+    if encoding == "delta" and len(data) > 1:
+        data = array(typecode, [data[0]] + [b - a for a, b in zip(data, data[1:])])
+    if typecode == "q" and data:
+        low, high = min(data), max(data)
+        for typecode in INTEGER_TYPES:
+            bound = 1 << (8 * array(typecode).itemsize - 1)
+            if -bound <= low and high < bound:
+                break
+        data = array(typecode, data)
+    if not LITTLE_ENDIAN:
+        data.byteswap()
+    block = data.tobytes()
+    return typecode, zlib.compress(block, 6) if compress else block
+
+
+def split_result(result):
+    """
+    A runner result (or an imported one) as its JSON summary without the raw
+    samples, and the samples as [(name, typecode, encoding, values)]
+    Lost latency probes become NaN; the analysis is reduced to its statuses
+    """
+    summary = {key: value for key, value in result.items() if key not in ("latency_samples", "analysis")}
+    if "analysis" in result:
+        summary["statuses"] = {case["title"]: case["status"] for case in result["analysis"]}
+    series = []
+    if result.get("latency_samples") is not None:
+        series.append(("latency", "d", "plain",
+                       [math.nan if rtt is None else rtt for rtt in result["latency_samples"]]))
+    transfers = {}
+    for direction, transfer in (result.get("transfers") or {}).items():
+        transfer = dict(transfer)
+        intervals = transfer.pop("intervals", None)
+        if intervals is not None:
+            columns = ([round(at * 1_000_000) for at, _ in intervals], [moved for _, moved in intervals])
+            for (name, typecode, encoding), values in zip(TRANSFER_SERIES, columns):
+                series.append((f"{direction}.{name}", typecode, encoding, values))
+        transfers[direction] = transfer
+    if transfers:
+        summary["transfers"] = transfers
+    return summary, series
+
+
+class ArchiveWriter:
+    """
+    Appends runs to an archive file, creating it if needed
+    Each write() packs one run and writes it in one go, so memory use doesn't
+    grow with the archive and readers see whole records
+    """
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        else:
+            with open(path, "rb") as f:
+                _check_header(f.read(FILE_HEADER.size))
+        self.count = 0
+
+    def write(self, result):
+        summary, series = split_result(result)
+        blocks, directory, offset = [], [], 0
+        for name, typecode, encoding, values in series:
+            typecode, block = _encode(values, typecode, encoding, self.compress)
+            directory.append({"name": name, "type": typecode, "encoding": encoding,
+                              "codec": "zlib" if self.compress else "none", "count": len(values),
+                              "offset": offset, "size": len(block)})
+            blocks += [block, bytes(_pad(len(block)))]
+            offset += len(block) + _pad(len(block))
+        meta = json.dumps({"summary": summary, "series": directory}, ensure_ascii=False).encode()
+        if self.compress:
+            meta = zlib.compress(meta, 6)
+        head = meta + bytes(_pad(len(meta)))
+        # Block offsets count from the end of the padded summary
+        body = b"".join([head] + blocks)
+        flags = SUMMARY_ZLIB if self.compress else 0
+        self.file.write(RECORD_HEADER.pack(len(body), len(meta), flags) + body)
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _check_header(data):
+    if len(data) < FILE_HEADER.size:
+        raise ValueError("not a cryos archive (too short)")
+    magic, version = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a cryos archive")
+    if version > VERSION:
+        raise ValueError(f"archive version {version} is newer than this cryos supports ({VERSION})")
+
+
+class ArchivedRun:
+    """
+    One record of an open archive: the summary plus lazily decoded series
+    """
+
+    def __init__(self, buffer, start, meta):
+        self._buffer = buffer
+        self._start = start
+        self.summary = meta["summary"]
+        self._series = {entry["name"]: entry for entry in meta["series"]}
+
+    @property
+    def names(self):
+        return list(self._series)
+
+    def series(self, name):
+        """
+        The named series: a memoryview into the mapped file when the block is
+        stored plain and uncompressed (valid until the archive is closed),
+        otherwise a freshly decoded array
+        """
+        entry = self._series[name]
+        start = self._start + entry["offset"]
+        block = self._buffer[start:start + entry["size"]]
+        if entry["codec"] == "zlib":
+            block = zlib.decompress(block)
+        elif entry["codec"] != "none":
+            raise ValueError(f"unknown codec {entry['codec']!r} for series {name}")
+        if entry["encoding"] == "plain" and entry["codec"] == "none" and LITTLE_ENDIAN:
+            return block.cast(entry["type"])
+        data = array(entry["type"])
+        data.frombytes(block)
+        if not LITTLE_ENDIAN:
+            data.byteswap()
+        if entry["encoding"] == "delta":
+            data = array("q", itertools.accumulate(data))
+        elif entry["encoding"] != "plain":
+            raise ValueError(f"unknown encoding {entry['encoding']!r} for series {name}")
+        return data
+
+    def to_result(self):
+        """
+        The run rebuilt in the runner's result layout, samples included
+        """
+        result = copy.deepcopy(self.summary)
+        if "latency" in self._series:
+            result["latency_samples"] = [None if math.isnan(rtt) else rtt for rtt in self.series("latency")]
+        for direction, transfer in (result.get("transfers") or {}).items():
+            if f"{direction}.t" in self._series:
+                times, moved = self.series(f"{direction}.t"), self.series(f"{direction}.bytes")
+                transfer["intervals"] = [[at / 1_000_000, n] for at, n in zip(times, moved)]
+        return result
+
+
+class ArchiveReader:
+    """
+    Memory mapped archive; iterate it for ArchivedRun records
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            _check_header(f.read(FILE_HEADER.size))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._map)
+
+    def __iter__(self):
+        offset = FILE_HEADER.size
+        end = len(self._buffer)
+        while offset < end:
+            if offset + RECORD_HEADER.size > end:
+                raise ValueError(f"truncated record at byte {offset}")
+            length, meta_length, flags = RECORD_HEADER.unpack_from(self._buffer, offset)
+            body = offset + RECORD_HEADER.size
+            if body + length > end:
+                raise ValueError(f"truncated record at byte {offset}")
+            meta = self._buffer[body:body + meta_length]
+            meta = json.loads(zlib.decompress(meta) if flags & SUMMARY_ZLIB else bytes(meta))
+            yield ArchivedRun(self._buffer, body + meta_length + _pad(meta_length), meta)
+            offset = body + length
+
+    def close(self):
+        """
+        Unmap the file; series views handed out must have been released
+        """
+        self._buffer.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def record_to_result(record):
+    """
+    A full HistoryStore row (with samples) in the runner's result layout
+    """
+    result = {
+        "timestamp": datetime.fromtimestamp(record["timestamp"], timezone.utc).isoformat(),
+        "server": {"id": record["server_id"], "host": record["server_host"], "name": record["server_name"]},
+        "ping": record["ping"],
+        "jitter": record["jitter"],
+        "loss": record["loss"],
+        "download": record["download"],
+        "upload": record["upload"],
+        **{column: record[column] for column in METRIC_COLUMNS},
+        "statuses": record["statuses"],
+        "run_id": record["id"],
+    }
+    result.update(record["samples"])
+    return result
+
+
+def export_history(store, path, compress=False, **query):
+    """
+    Stream history runs (filtered like HistoryStore.query) into an archive;
+    returns the number of runs written
+    """
+    with ArchiveWriter(path, compress=compress) as writer:
+        for record in store.query(with_samples=True, order_by="id", **query):
+            writer.write(record_to_result(record))
+        return writer.count
+
+
+def reanalyze(path):
+    """
+    Yield every archived run as a result with a fresh analysis under the
+    current rules, next to the statuses recorded when it was archived
+    """
+    with ArchiveReader(path) as reader:
+        for run in reader:
+            result = run.to_result()
+            result["analysis"] = analyze(result)
+            yield result
@@ -0,0 +1,521 @@
+"""
+The ``cryos`` command line tool: run the speed test headless and print JSON
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from cryos import __version__
+from cryos.throughput import DOWNLOAD_SIZES
+
+
+def positive_float(text):
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {text}")
+    return value
+
+
+def print_progress(phase, fraction, message):
+    print(f"[{phase} {fraction:4.0%}] {message}", file=sys.stderr)
+
+
+def build_selector(args):
+    from cryos.servers import ServerSelector
+    return ServerSelector(args.speedtest_url, candidates=args.candidates)
+
+
+def cmd_run(args):
+    from cryos.profiling import NULL_TRACER, Tracer, enabled
+    from cryos.runner import do_nothing, run_speed_test, server_from_url
+    from cryos.suitability import analyze, build_suggestions
+
+    tracer = Tracer() if args.trace or enabled() else NULL_TRACER
+    realtime = None
+    if args.realtime:
+        from cryos.realtime import parse_target
+        host, port = parse_target(args.realtime)
+        realtime = {"host": host, "port": port, "rate": args.realtime_rate, "duration": args.realtime_duration}
+    run_span = tracer.span("run").begin()
+    result = run_speed_test(
+        num_pings=args.pings,
+        tracer=tracer,
+        realtime=realtime,
+        server=server_from_url(args.server_url) if args.server_url else None,
+        selector=build_selector(args),
+        loaded_latency=not args.no_loaded_latency,
+        on_progress=print_progress if args.verbose else do_nothing,
+        streams=args.streams,
+        duration=args.duration,
+        warmup=args.warmup,
+        tolerance=args.tolerance or None,
+        min_duration=args.min_duration,
+        chunk_size=args.chunk_size,
+        download_size=args.download_size,
+        upload_size=args.upload_size,
+    )
+    with tracer.span("analysis"):
+        result["analysis"] = analyze(result)
+        if args.suggestions:
+            result["suggestions"] = build_suggestions(result)
+    run_span.finish()
+    if tracer.active:
+        result["timings"] = tracer.to_dict()
+    if args.trace:
+        tracer.dump(args.trace)
+    if not args.no_history:
+        from cryos.history import HistoryStore
+        result["run_id"] = HistoryStore(args.history).append(result)
+    if args.archive:
+        from cryos.archive import ArchiveWriter
+        with ArchiveWriter(args.archive, compress=args.compress) as writer:
+            writer.write(result)
+    json.dump(result, sys.stdout, indent=args.indent, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_compare(args):
+    from cryos.compare import compare_servers
+    from cryos.runner import do_nothing, server_from_url
+
+    if args.server_url:
+        servers = [server_from_url(url) for url in args.server_url]
+    else:
+        selector = build_selector(args)
+        config = selector.config(refresh=args.refresh_servers)
+        candidates = selector.closest(config, selector.servers(refresh=args.refresh_servers))
+        servers = [dict(server, latency=latency)
+                   for latency, server in selector.probe_candidates(candidates)[:args.count]]
+    result = compare_servers(
+        servers,
+        mode=args.mode,
+        num_pings=args.pings,
+        budget_bytes=args.budget_mb * 1_000_000 if args.budget_mb else None,
+        on_progress=print_progress if args.verbose else do_nothing,
+        streams=args.streams,
+        duration=args.duration,
+        warmup=args.warmup,
+    )
+    json.dump(result, sys.stdout, indent=args.indent, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_realtime(args):
+    from cryos.realtime import parse_target, simulate_stream
+
+    host, port = parse_target(args.target)
+    result = simulate_stream(host, port, rate=args.rate, duration=args.duration, payload=args.payload,
+                             timeout=args.timeout)
+    json.dump(result, sys.stdout, indent=args.indent, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0 if result["received"] else 1
+
+
+def cmd_servers(args):
+    selector = build_selector(args)
+    if args.list:
+        config = selector.config(refresh=args.refresh_servers)
+        candidates = selector.closest(config, selector.servers(refresh=args.refresh_servers))
+        ranked = selector.probe_candidates(candidates)
+        json.dump([dict(server, latency=latency) for latency, server in ranked], sys.stdout,
+                  indent=args.indent, ensure_ascii=False)
+    else:
+        json.dump(selector.best(refresh=args.refresh_servers), sys.stdout, indent=args.indent,
+                  ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_history(args):
+    from cryos.history import HistoryStore
+
+    store = HistoryStore(args.history)
+    if args.run_id is not None:
+        record = store.get(args.run_id)
+        if record is None:
+            print(json.dumps({"error": f"no run with id {args.run_id}"}), file=sys.stderr)
+            return 1
+        json.dump(record, sys.stdout, ensure_ascii=False)
+        sys.stdout.write("\n")
+        return 0
+    # One JSON document per line, streamed straight from the store
+    for record in store.query(start=args.since, end=args.until, server=args.server,
+                              limit=args.limit, newest_first=args.newest_first):
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return 0
+
+
+def cmd_export(args):
+    from cryos.archive import export_history
+    from cryos.history import HistoryStore
+
+    written = export_history(HistoryStore(args.history), args.archive, compress=args.compress,
+                             start=args.since, end=args.until, server=args.server)
+    json.dump({"archive": args.archive, "runs": written, "bytes": os.path.getsize(args.archive)}, sys.stdout)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_import(args):
+    from cryos.archive import reanalyze
+
+    store = None
+    if args.save:
+        from cryos.history import HistoryStore
+        store = HistoryStore(args.history)
+    # One re-analyzed run per line, read straight from the mapped archive
+    for result in reanalyze(args.archive):
+        if store is not None:
+            result["run_id"] = store.append(result)
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return 0
+
+
+def cmd_report(args):
+    from datetime import datetime, timezone
+    from cryos.history import HistoryStore
+    from cryos.scoring import load_history, score
+
+    timestamps, matrix = load_history(HistoryStore(args.history), start=args.since, end=args.until,
+                                      server=args.server)
+    scores = score(matrix)
+    report = {
+        "runs": len(timestamps),
+        "start": datetime.fromtimestamp(timestamps.min(), timezone.utc).isoformat() if len(timestamps) else None,
+        "end": datetime.fromtimestamp(timestamps.max(), timezone.utc).isoformat() if len(timestamps) else None,
+        "statuses": scores.counts(),
+        "limiting": scores.limiting_counts(),
+    }
+    json.dump(report, sys.stdout, indent=args.indent, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_rules(args):
+    from cryos.rules import compile_file, default_path
+
+    path = args.path or default_path()
+    plan = compile_file(path)
+    json.dump({"path": path, "use_cases": [case["title"] for case in plan.use_cases],
+               "suggestion_rules": len(plan.suggestion_rules)}, sys.stdout, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_ingest(args):
+    from cryos.fleet import FleetServer, FleetStore
+
+    server = FleetServer(FleetStore(args.db), host=args.host, port=args.port,
+                         token=args.token or os.environ.get("CRYOS_FLEET_TOKEN"))
+    print(f"Accepting results on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return 0
+
+
+def cmd_push(args):
+    from cryos.fleet import push
+    from cryos.history import HistoryStore
+    from cryos.servers import CACHE_DIR
+
+    # Remember the last pushed run per destination and site, so a cron job
+    # only sends what is new
+    key = "".join(c if c.isalnum() else "_" for c in f"{args.url}-{args.site}")
+    marker = os.path.join(CACHE_DIR, f"push-{key}.json")
+    try:
+        with open(marker, encoding="utf-8") as f:
+            last_id = json.load(f)["last_id"]
+    except (OSError, ValueError, KeyError):
+        last_id = None
+
+    token = args.token or os.environ.get("CRYOS_FLEET_TOKEN")
+    pushed, batch = 0, []
+
+    def flush():
+        nonlocal pushed, last_id
+        pushed += push(args.url, args.site, batch, token=token)
+        last_id = batch[-1]["id"]
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(marker, "w", encoding="utf-8") as f:
+            json.dump({"last_id": last_id}, f)
+        batch.clear()
+
+    for record in HistoryStore(args.history).query(start=args.since, after_id=last_id, order_by="id"):
+        batch.append(record)
+        if len(batch) >= args.batch_size:
+            flush()
+    if batch:
+        flush()
+    json.dump({"pushed": pushed, "last_id": last_id}, sys.stdout)
+    sys.stdout.write("\n")
+    return 0
+
+
+def cmd_monitor(args):
+    from cryos.history import HistoryStore
+    from cryos.monitor import Monitor
+    from cryos.runner import server_from_url
+
+    if args.server_url:
+        server = server_from_url(args.server_url)
+    else:
+        # Discover once; every probe and full test reuses the server
+        server = build_selector(args).best(refresh=args.refresh_servers)
+
+    def emit(event):
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    monitor = Monitor(
+        server,
+        store=None if args.no_history else HistoryStore(args.history),
+        probe_interval=args.probe_interval,
+        full_interval=args.full_interval,
+        window=args.window,
+        pings=args.pings,
+        budget_bytes=args.budget_mb * 1_000_000 if args.budget_mb else None,
+        budget_period=args.budget_period,
+        on_event=emit,
+        throughput_options={"streams": args.streams, "duration": args.duration, "warmup": args.warmup,
+                            "tolerance": args.tolerance or None, "min_duration": args.min_duration},
+    )
+    try:
+        monitor.run(iterations=args.iterations)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_serve(args):
+    from cryos.localserver import LocalSpeedtestServer, UdpEchoServer
+
+    server = LocalSpeedtestServer(
+        host=args.host,
+        port=args.port,
+        download_mbps=args.download_mbps,
+        upload_mbps=args.upload_mbps,
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+    )
+    print(f"Serving the speedtest protocol on http://{server.host}/ "
+          f"(use --server-url {server.upload_url})", file=sys.stderr)
+    echo = None
+    if not args.no_udp:
+        echo = UdpEchoServer(args.host, server.server_address[1], loss=args.udp_loss, burst=args.udp_burst).start()
+        print(f"Echoing UDP on {server.host} (use --realtime {server.host})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if echo is not None:
+            echo.stop()
+    return 0
+
+
+def add_discovery_arguments(parser):
+    parser.add_argument("--speedtest-url", default="https://www.speedtest.net",
+                        help="where to fetch the config and server list (default: https://www.speedtest.net)")
+    parser.add_argument("--candidates", type=int, default=5,
+                        help="closest servers probed concurrently during discovery (default: 5)")
+    parser.add_argument("--refresh-servers", action="store_true",
+                        help="ignore the cached server list and best-server index")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cryos",
+        description="Cryos network suitability analyzer (headless mode)",
+    )
+    parser.add_argument("--version", action="version", version=f"cryos {__version__}")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("run", help="run a speed test and print the result as JSON")
+    run.add_argument("--server-url", help="test against this upload.php URL instead of discovering a server")
+    add_discovery_arguments(run)
+    run.add_argument("--pings", type=int, default=5, help="number of latency probes (default: 5)")
+    run.add_argument("--streams", type=int, default=4, help="concurrent connections per direction (default: 4)")
+    run.add_argument("--duration", type=float, default=10.0,
+                     help="wall-clock cap per direction in seconds (default: 10)")
+    run.add_argument("--warmup", type=float, default=2.0,
+                     help="leading seconds discarded as TCP slow-start (default: 2)")
+    run.add_argument("--tolerance", type=float, default=0.05,
+                     help="stop a direction once its speed is stable within this fraction, 0 to always run"
+                          " the full duration (default: 0.05)")
+    run.add_argument("--min-duration", type=float, default=4.0,
+                     help="seconds each direction runs at least when stopping early (default: 4, at most --duration)")
+    run.add_argument("--chunk-size", type=int, default=65536, help="bytes per read/send (default: 65536)")
+    run.add_argument("--download-size", type=int, default=4000, choices=DOWNLOAD_SIZES,
+                     help="randomNxN.jpg image to download (default: 4000)")
+    run.add_argument("--upload-size", type=int, default=4_194_304,
+                     help="bytes per upload request (default: 4194304)")
+    run.add_argument("--realtime", metavar="HOST:PORT",
+                     help="also send a paced UDP stream to this echo server (e.g. cryos serve) for packet loss,"
+                          " loss bursts and MOS")
+    run.add_argument("--realtime-rate", type=positive_float, default=50.0, help="real-time packets per second (default: 50)")
+    run.add_argument("--realtime-duration", type=positive_float, default=10.0,
+                     help="real-time stream length in seconds (default: 10)")
+    run.add_argument("--no-loaded-latency", action="store_true",
+                     help="don't probe latency during the transfers (no bufferbloat measurement)")
+    run.add_argument("--indent", type=int, default=None, help="indent the JSON output")
+    run.add_argument("--suggestions", action="store_true", help="include improvement suggestions")
+    run.add_argument("--trace", metavar="PATH",
+                     help="write a Chrome trace of the test phases to PATH and add \"timings\" to the output"
+                          " ($CRYOS_PROFILE=1 adds the timings only)")
+    run.add_argument("-v", "--verbose", action="store_true", help="print progress to stderr")
+    run.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    run.add_argument("--no-history", action="store_true", help="don't record the run in the history")
+    run.add_argument("--archive", metavar="PATH", help="also append the run and its raw samples to this sample archive")
+    run.add_argument("--compress", action="store_true", help="zlib compress the archived run")
+    run.set_defaults(func=cmd_run)
+
+    compare = subparsers.add_parser("compare", help="test several servers and locate the bottleneck")
+    compare.add_argument("--server-url", action="append",
+                         help="upload.php URL to include (repeatable; default: the closest discovered servers)")
+    add_discovery_arguments(compare)
+    compare.add_argument("--count", type=int, default=3, help="discovered servers to compare (default: 3)")
+    compare.add_argument("--mode", choices=("parallel", "sequential"), default="parallel",
+                         help="test all servers at once or one after another (default: parallel)")
+    compare.add_argument("--pings", type=int, default=5, help="latency probes per server (default: 5)")
+    compare.add_argument("--streams", type=int, default=2, help="connections per server and direction (default: 2)")
+    compare.add_argument("--duration", type=float, default=10.0, help="cap per direction in seconds (default: 10)")
+    compare.add_argument("--warmup", type=float, default=2.0, help="warm-up seconds discarded (default: 2)")
+    compare.add_argument("--budget-mb", type=float,
+                         help="megabytes the whole comparison may move, shared by all servers")
+    compare.add_argument("--indent", type=int, default=None, help="indent the JSON output")
+    compare.add_argument("-v", "--verbose", action="store_true", help="print progress to stderr")
+    compare.set_defaults(func=cmd_compare)
+
+    servers = subparsers.add_parser("servers", help="select the best server and print it as JSON")
+    add_discovery_arguments(servers)
+    servers.add_argument("--list", action="store_true", help="print every probed candidate instead")
+    servers.add_argument("--indent", type=int, default=None, help="indent the JSON output")
+    servers.set_defaults(func=cmd_servers)
+
+    history = subparsers.add_parser("history", help="print recorded runs as JSON lines")
+    history.add_argument("--since", help="ISO 8601 start time (inclusive)")
+    history.add_argument("--until", help="ISO 8601 end time (exclusive)")
+    history.add_argument("--server", help="only runs against this server host")
+    history.add_argument("--limit", type=int, help="maximum number of runs")
+    history.add_argument("--newest-first", action="store_true", help="newest runs first")
+    history.add_argument("--run-id", type=int, help="print one run with its raw samples")
+    history.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    history.set_defaults(func=cmd_history)
+
+    export = subparsers.add_parser("export", help="append recorded runs with their raw samples to a binary archive")
+    export.add_argument("archive", help="archive file, created if missing")
+    export.add_argument("--since", help="ISO 8601 start time (inclusive)")
+    export.add_argument("--until", help="ISO 8601 end time (exclusive)")
+    export.add_argument("--server", help="only runs against this server host")
+    export.add_argument("--compress", action="store_true", help="zlib compress the summaries and samples")
+    export.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    export.set_defaults(func=cmd_export)
+
+    import_ = subparsers.add_parser("import", help="re-analyze archived runs under the current rules as JSON lines")
+    import_.add_argument("archive", help="archive written by export or run --archive")
+    import_.add_argument("--save", action="store_true", help="also record the runs in the history")
+    import_.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    import_.set_defaults(func=cmd_import)
+
+    report = subparsers.add_parser("report", help="summarize suitability over recorded runs (needs numpy)")
+    report.add_argument("--since", help="ISO 8601 start time (inclusive)")
+    report.add_argument("--until", help="ISO 8601 end time (exclusive)")
+    report.add_argument("--server", help="only runs against this server host")
+    report.add_argument("--indent", type=int, default=None, help="indent the JSON output")
+    report.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    report.set_defaults(func=cmd_report)
+
+    rules = subparsers.add_parser("rules", help="validate a suitability rule file")
+    rules.add_argument("path", nargs="?", help="JSON or YAML rule file (default: $CRYOS_RULES or the bundled rules)")
+    rules.set_defaults(func=cmd_rules)
+
+    monitor = subparsers.add_parser("monitor", help="monitor continuously and print JSON lines")
+    monitor.add_argument("--server-url", help="monitor this upload.php URL instead of discovering a server")
+    add_discovery_arguments(monitor)
+    monitor.add_argument("--probe-interval", type=float, default=60.0,
+                         help="seconds between latency probes (default: 60)")
+    monitor.add_argument("--full-interval", type=float, default=3600.0,
+                         help="seconds between full throughput tests (default: 3600)")
+    monitor.add_argument("--window", type=float, default=900.0,
+                         help="seconds per suitability verdict window (default: 900)")
+    monitor.add_argument("--pings", type=int, default=10, help="latency probes per run (default: 10)")
+    monitor.add_argument("--budget-mb", type=float,
+                         help="megabytes the full tests may move per budget period (default: unlimited)")
+    monitor.add_argument("--budget-period", type=float, default=86400.0,
+                         help="budget refill period in seconds (default: 86400)")
+    monitor.add_argument("--streams", type=int, default=4, help="connections per direction in full tests")
+    monitor.add_argument("--duration", type=float, default=10.0, help="full test cap per direction in seconds")
+    monitor.add_argument("--warmup", type=float, default=2.0, help="warm-up seconds discarded in full tests")
+    monitor.add_argument("--tolerance", type=float, default=0.05,
+                         help="stability that ends a full test direction early, 0 to disable")
+    monitor.add_argument("--min-duration", type=float, default=4.0,
+                         help="seconds each full test direction runs at least (at most --duration)")
+    monitor.add_argument("--iterations", type=int, help=argparse.SUPPRESS)
+    monitor.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    monitor.add_argument("--no-history", action="store_true", help="don't record runs in the history")
+    monitor.set_defaults(func=cmd_monitor)
+
+    ingest = subparsers.add_parser("ingest", help="run the fleet ingestion server")
+    ingest.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    ingest.add_argument("--port", type=int, default=8090, help="port to listen on (default: 8090)")
+    ingest.add_argument("--db", help="fleet database (default: $CRYOS_FLEET_DB or ~/.local/share/cryos)")
+    ingest.add_argument("--token", help="require this bearer token (default: $CRYOS_FLEET_TOKEN)")
+    ingest.set_defaults(func=cmd_ingest)
+
+    push = subparsers.add_parser("push", help="send new history runs to a fleet ingestion server")
+    push.add_argument("url", help="ingestion URL, e.g. http://fleet.example:8090/ingest")
+    push.add_argument("--site", required=True, help="name of this site")
+    push.add_argument("--since", help="ISO 8601 start time for the first push")
+    push.add_argument("--batch-size", type=int, default=500, help="runs per request (default: 500)")
+    push.add_argument("--token", help="bearer token (default: $CRYOS_FLEET_TOKEN)")
+    push.add_argument("--history", help="history database (default: $CRYOS_HISTORY or ~/.local/share/cryos)")
+    push.set_defaults(func=cmd_push)
+
+    serve = subparsers.add_parser("serve", help="run a local speedtest server for offline benchmarking")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    serve.add_argument("--download-mbps", type=float, help="shape the aggregate download rate")
+    serve.add_argument("--upload-mbps", type=float, help="shape the aggregate upload rate")
+    serve.add_argument("--latency", type=float, default=0.0, help="added latency per response in ms")
+    serve.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter on the added latency in ms")
+    serve.add_argument("--no-udp", action="store_true", help="don't answer UDP echo on the same port")
+    serve.add_argument("--udp-loss", type=float, default=0.0, help="share of UDP echoes to drop (default: 0)")
+    serve.add_argument("--udp-burst", type=float, default=1.0,
+                       help="mean length of UDP loss bursts in packets (default: 1, independent loss)")
+    serve.set_defaults(func=cmd_serve)
+
+    realtime = subparsers.add_parser("realtime", help="measure packet loss, bursts and MOS with a paced UDP stream")
+    realtime.add_argument("target", help="HOST:PORT of a UDP echo server, e.g. cryos serve")
+    realtime.add_argument("--rate", type=positive_float, default=50.0, help="packets per second (default: 50, a 20 ms codec)")
+    realtime.add_argument("--duration", type=positive_float, default=30.0, help="stream length in seconds (default: 30)")
+    realtime.add_argument("--payload", type=int, default=160, help="bytes per packet (default: 160, G.711)")
+    realtime.add_argument("--timeout", type=float, default=1.0,
+                          help="seconds to wait for late echoes after the last packet (default: 1)")
+    realtime.add_argument("--indent", type=int, default=None, help="indent the JSON output")
+    realtime.set_defaults(func=cmd_realtime)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # A bare ``cryos`` runs the test with the default options
+        args = parser.parse_args(["run"] + (argv if argv is not None else sys.argv[1:]))
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print(json.dumps({"error": str(e), "type": type(e).__name__}), file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Multi-server comparison: the same test against several servers, either all at
+once or back to back, to tell the access link apart from a congested server
+In parallel mode the servers share the link, so the sum of their speeds is the
+access link's capacity; in sequential mode each server gets the link to
+itself and the best one bounds it. Either way, servers well below the others
+point at a remote bottleneck, and servers that all agree at the local one
+"""
+
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from cryos.latency import probe_latency
+from cryos.throughput import do_nothing, measure_throughput
+
+MODES = ("parallel", "sequential")
+
+# Servers more than this far below the best one count as a remote bottleneck
+SPREAD_THRESHOLD = 0.25
+
+SERVER_KEYS = ("id", "name", "country", "sponsor", "host", "url", "d", "latency")
+
+
+def spread(values):
+    """
+    Relative spread of per-server speeds: (best - worst) / best
+    """
+    values = [v for v in values if v is not None]
+    if len(values) < 2 or max(values) <= 0:
+        return 0.0
+    return (max(values) - min(values)) / max(values)
+
+
+def diagnose(rows, aggregate, mode, threshold=SPREAD_THRESHOLD):
+    """
+    Locate the bottleneck from the per-server speeds
+    In parallel mode each server's share is compared with an even split of the
+    aggregate; in sequential mode each server is compared with the best one
+    Returns ("local" or "remote", hosts of the slow servers)
+    """
+    slow = set()
+    for direction in ("download", "upload"):
+        speeds = [row[direction] for row in rows]
+        if mode == "parallel":
+            reference = aggregate[direction] / len(rows) if rows else 0.0
+        else:
+            reference = max(speeds, default=0.0)
+        for row, speed in zip(rows, speeds):
+            if reference > 0 and speed < reference * (1 - threshold):
+                slow.add(row["server"]["host"])
+    return ("remote" if slow else "local"), sorted(slow)
+
+
+def shared_window_mbps(transfers):
+    """
+    Each concurrent transfer's steady rate over the window they all shared:
+    from the last warm-up end to the first transfer end
+    A transfer that ends early (e.g. on its byte cap) leaves the others the
+    whole link, which would inflate their rates and the summed aggregate.
+    Falls back to each transfer's own rate when the window holds no interval
+    """
+    start = max(transfer["warmup"] for transfer in transfers)
+    end = min(transfer["elapsed"] for transfer in transfers)
+    rates = []
+    for transfer in transfers:
+        moved, seconds, previous = 0, 0.0, 0.0
+        for at, n in transfer["intervals"]:
+            if start < at <= end:
+                moved += n
+                seconds += at - previous
+            previous = at
+        rates.append(moved * 8 / seconds / 1_000_000 if seconds > 0 else None)
+    if None in rates:
+        return [transfer["mbps"] for transfer in transfers]
+    return rates
+
+
+def compare_servers(servers, mode="parallel", num_pings=5, budget_bytes=None, on_progress=do_nothing,
+                    **throughput_options):
+    """
+    Test download and upload against every server in servers (speedtest-cli
+    style entries) and return a per-server table plus the aggregate
+    budget_bytes caps the bytes the whole comparison may move; it is split
+    evenly between the servers and both directions. In parallel mode the
+    rates are taken over the window every server was transferring in, as the
+    caps end the servers' transfers at different times
+    on_progress(phase, fraction, message) reports progress per direction
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if not servers:
+        raise ValueError("no servers to compare")
+    if budget_bytes is not None:
+        throughput_options["max_bytes"] = budget_bytes / (2 * len(servers))
+
+    on_progress("latency", 0.0, f"Measuring latency to {len(servers)} servers...")
+    # Latency first and never under load, so the transfers don't skew it
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        latencies = list(executor.map(lambda server: probe_latency(server, num_probes=num_pings), servers))
+    on_progress("latency", 1.0, "Latency measured")
+
+    transfers = [{} for _ in servers]
+    for direction in ("download", "upload"):
+        on_progress(direction, 0.0, f"Testing {direction} speed against {len(servers)} servers ({mode})...")
+
+        def measure(index):
+            transfers[index][direction] = measure_throughput(servers[index], direction, **throughput_options)
+
+        if mode == "parallel":
+            with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+                list(executor.map(measure, range(len(servers))))
+            rates = shared_window_mbps([transfer[direction] for transfer in transfers])
+            for transfer, rate in zip(transfers, rates):
+                transfer[direction] = dict(transfer[direction], mbps=rate)
+        else:
+            for index in range(len(servers)):
+                measure(index)
+                on_progress(direction, (index + 1) / len(servers),
+                            f"{servers[index]['sponsor']}: {transfers[index][direction]['mbps']:.2f} Mbps")
+        on_progress(direction, 1.0, f"{direction.capitalize()} done")
+
+    rows = []
+    for server, latency, transfer in zip(servers, latencies, transfers):
+        rows.append({
+            "server": {key: server.get(key) for key in SERVER_KEYS},
+            "ping": latency["mean"],
+            "ping_p90": latency["p90"],
+            "jitter": latency["jitter"],
+            "loss": latency["loss"],
+            "download": transfer["download"]["mbps"],
+            "upload": transfer["upload"]["mbps"],
+            "bytes": transfer["download"]["bytes"] + transfer["upload"]["bytes"],
+        })
+
+    combine = sum if mode == "parallel" else max
+    pings = [row["ping"] for row in rows if row["ping"] is not None]
+    aggregate = {
+        # The access link's capacity estimate
+        "download": combine(row["download"] for row in rows),
+        "upload": combine(row["upload"] for row in rows),
+        "ping": min(pings) if pings else None,
+        "median_ping": statistics.median(pings) if pings else None,
+        "bytes": sum(row["bytes"] for row in rows),
+    }
+    bottleneck, slow = diagnose(rows, aggregate, mode)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
+        "servers": rows,
+        "aggregate": aggregate,
+        "spread": {"download": spread(row["download"] for row in rows),
+                   "upload": spread(row["upload"] for row in rows)},
+        "bottleneck": bottleneck,
+        "slow_servers": slow,
+    }
@@ -0,0 +1,349 @@
+"""
+Fleet aggregation: headless agents on many sites POST batches of results to a
+small ingestion server, which keeps them in one SQLite store together with
+hourly and daily rollups per site. The rollups are updated in the same
+transaction as the insert, so dashboards read a handful of pre-aggregated rows
+instead of scanning raw results. Everything runs locally on the standard library
+"""
+
+import hmac
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import closing
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from cryos.history import to_epoch
+from cryos.suitability import analyze
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "cryos", "fleet.sqlite3")
+
+# Bucket length in seconds per rollup period
+PERIODS = {"hour": 3600, "day": 86400}
+
+ROLLUP_METRICS = ("download", "upload", "ping", "jitter", "loss", "bufferbloat")
+
+# Largest accepted request body
+MAX_BODY = 16 * 1024 * 1024
+
+# Accepted result times: from 2000-01-01 to a day ahead of the server's clock
+MIN_TIMESTAMP = 946684800.0
+MAX_CLOCK_SKEW = 86400.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    server_host TEXT,
+    download REAL,
+    upload REAL,
+    ping REAL,
+    jitter REAL,
+    loss REAL,
+    bufferbloat REAL,
+    statuses TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_site_timestamp ON results (site, timestamp);
+CREATE INDEX IF NOT EXISTS results_timestamp ON results (timestamp);
+CREATE TABLE IF NOT EXISTS rollups (
+    site TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket REAL NOT NULL,
+    runs INTEGER NOT NULL,
+    {metric_columns},
+    PRIMARY KEY (period, bucket, site)
+);
+CREATE TABLE IF NOT EXISTS rollup_statuses (
+    site TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket REAL NOT NULL,
+    use_case TEXT NOT NULL,
+    status TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    PRIMARY KEY (period, bucket, site, use_case, status)
+);
+""".format(metric_columns=",\n    ".join(f"{m}_sum REAL NOT NULL DEFAULT 0, {m}_n INTEGER NOT NULL DEFAULT 0"
+                                         for m in ROLLUP_METRICS))
+
+
+def default_path():
+    return os.environ.get("CRYOS_FLEET_DB", DEFAULT_PATH)
+
+
+def normalize(result):
+    """
+    Flatten a runner result or a history row into the stored columns
+    Results without suitability statuses are analyzed on ingestion
+    """
+    if not isinstance(result, dict):
+        raise ValueError("every result must be a JSON object")
+    row = {metric: result.get(metric) for metric in ROLLUP_METRICS}
+    for metric, value in row.items():
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not math.isfinite(value)):
+            raise ValueError(f"{metric} must be a finite number")
+    server = result.get("server")
+    row["server_host"] = server.get("host") if isinstance(server, dict) else result.get("server_host")
+    if row["server_host"] is not None and not isinstance(row["server_host"], str):
+        raise ValueError("the server host must be a string")
+    timestamp = result.get("timestamp")
+    if timestamp is None:
+        row["timestamp"] = datetime.now(timezone.utc).timestamp()
+    elif isinstance(timestamp, str) or (isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool)
+                                        and math.isfinite(timestamp)):
+        # to_epoch raises ValueError for strings that aren't ISO 8601
+        row["timestamp"] = to_epoch(timestamp)
+    else:
+        raise ValueError("timestamp must be epoch seconds or an ISO 8601 string")
+    if not MIN_TIMESTAMP <= row["timestamp"] <= datetime.now(timezone.utc).timestamp() + MAX_CLOCK_SKEW:
+        raise ValueError(f"timestamp {timestamp!r} is out of range")
+    if isinstance(result.get("statuses"), dict) and result["statuses"]:
+        row["statuses"] = result["statuses"]
+        if not all(isinstance(k, str) and isinstance(v, str) for k, v in row["statuses"].items()):
+            raise ValueError("statuses must map use case titles to status names")
+    elif isinstance(result.get("analysis"), list) and result["analysis"]:
+        if not all(isinstance(case, dict) and isinstance(case.get("title"), str) and isinstance(case.get("status"), str)
+                   for case in result["analysis"]):
+            raise ValueError("analysis entries must have a title and a status")
+        row["statuses"] = {case["title"]: case["status"] for case in result["analysis"]}
+    else:
+        row["statuses"] = {case["title"]: case["status"] for case in analyze(row)}
+    return row
+
+
+class FleetStore:
+    """
+    Shared result store with incrementally maintained rollups
+    Like HistoryStore, connections are opened per call so the ingestion
+    server's threads and the dashboard can share one store
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def ingest(self, site, results):
+        """
+        Store a batch of results from one site and fold them into the rollups,
+        all in one transaction; returns the number of results stored
+        """
+        if not site or not isinstance(site, str):
+            raise ValueError("site must be a non-empty string")
+        rows = [normalize(result) for result in results]
+        metric_updates = ", ".join(f"{m}_sum = {m}_sum + excluded.{m}_sum, {m}_n = {m}_n + excluded.{m}_n"
+                                   for m in ROLLUP_METRICS)
+        metric_names = ", ".join(f"{m}_sum, {m}_n" for m in ROLLUP_METRICS)
+        placeholders = ", ".join("?" for _ in range(4 + 2 * len(ROLLUP_METRICS)))
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT INTO results (site, timestamp, server_host, download, upload, ping, jitter, loss,"
+                " bufferbloat, statuses) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(site, row["timestamp"], row["server_host"], row["download"], row["upload"], row["ping"],
+                  row["jitter"], row["loss"], row["bufferbloat"], json.dumps(row["statuses"], ensure_ascii=False))
+                 for row in rows],
+            )
+            for row in rows:
+                for period, length in PERIODS.items():
+                    bucket = row["timestamp"] - row["timestamp"] % length
+                    values = []
+                    for metric in ROLLUP_METRICS:
+                        value = row[metric]
+                        values += [value or 0.0, 0 if value is None else 1]
+                    connection.execute(
+                        f"INSERT INTO rollups (site, period, bucket, runs, {metric_names})"
+                        f" VALUES ({placeholders}) ON CONFLICT (period, bucket, site)"
+                        f" DO UPDATE SET runs = runs + 1, {metric_updates}",
+                        [site, period, bucket, 1] + values,
+                    )
+                    connection.executemany(
+                        "INSERT INTO rollup_statuses (site, period, bucket, use_case, status, runs)"
+                        " VALUES (?, ?, ?, ?, ?, 1) ON CONFLICT (period, bucket, site, use_case, status)"
+                        " DO UPDATE SET runs = runs + 1",
+                        [(site, period, bucket, use_case, status) for use_case, status in row["statuses"].items()],
+                    )
+        return len(rows)
+
+    def _range(self, period, start, end, site):
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        clauses, params = ["period = ?"], [period]
+        if start is not None:
+            clauses.append("bucket >= ?")
+            params.append(to_epoch(start) - to_epoch(start) % PERIODS[period])
+        if end is not None:
+            clauses.append("bucket < ?")
+            params.append(to_epoch(end))
+        if site is not None:
+            clauses.append("site = ?")
+            params.append(site)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def rollups(self, period="hour", start=None, end=None, site=None):
+        """
+        Per site and bucket: run count and the mean of every metric
+        """
+        where, params = self._range(period, start, end, site)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"SELECT * FROM rollups{where} ORDER BY bucket, site", params).fetchall()
+        summaries = []
+        for row in rows:
+            summary = {"site": row["site"], "bucket": row["bucket"], "runs": row["runs"]}
+            for metric in ROLLUP_METRICS:
+                n = row[f"{metric}_n"]
+                summary[metric] = row[f"{metric}_sum"] / n if n else None
+            summaries.append(summary)
+        return summaries
+
+    def suitability(self, period="day", start=None, end=None, site=None):
+        """
+        {site: {use case: {status: runs}}} summed over the buckets in range
+        """
+        where, params = self._range(period, start, end, site)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT site, use_case, status, SUM(runs) AS runs FROM rollup_statuses{where}"
+                " GROUP BY site, use_case, status", params).fetchall()
+        report = {}
+        for row in rows:
+            report.setdefault(row["site"], {}).setdefault(row["use_case"], {})[row["status"]] = row["runs"]
+        return report
+
+    def sites(self):
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT site, COUNT(*) AS runs, MAX(timestamp) AS last_seen FROM results GROUP BY site"
+                " ORDER BY site").fetchall()
+        return [dict(row) for row in rows]
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """
+    POST /ingest with {"site": ..., "results": [...]}; GET /health
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "CryosFleet/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, document):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.reply(200, {"ok": True})
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/ingest":
+            self.reply(404, {"error": "not found"})
+            return
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+            self.reply(401, {"error": "unauthorized"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.reply(400, {"error": "invalid Content-Length"})
+            self.close_connection = True
+            return
+        if length > MAX_BODY:
+            self.reply(413, {"error": f"batches are limited to {MAX_BODY} bytes"})
+            self.close_connection = True
+            return
+        try:
+            document = json.loads(self.rfile.read(length))
+            if not isinstance(document, dict) or not isinstance(document.get("results"), list):
+                raise ValueError("expected {\"site\": ..., \"results\": [...]}")
+            stored = self.server.store.ingest(document.get("site"), document["results"])
+        except ValueError as e:
+            self.reply(400, {"error": str(e)})
+            return
+        self.reply(200, {"ingested": stored})
+
+
+class FleetServer(ThreadingHTTPServer):
+    """
+    The ingestion endpoint, usable as a context manager
+    token, when set, must be sent as "Authorization: Bearer <token>"
+    """
+
+    daemon_threads = True
+
+    def __init__(self, store, host="127.0.0.1", port=8090, token=None):
+        self.store = store
+        self.token = token
+        self._thread = None
+        super().__init__((host, port), IngestHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/ingest"
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def push(url, site, results, token=None, timeout=30.0):
+    """
+    Send one batch of results to an ingestion server; returns the count stored
+    """
+    headers = {"Content-Type": "application/json", "User-Agent": "Cryos"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    body = json.dumps({"site": site, "results": results}, ensure_ascii=False).encode()
+    try:
+        with urlopen(Request(url, data=body, headers=headers, method="POST"), timeout=timeout) as response:
+            return json.loads(response.read())["ingested"]
+    except HTTPError as e:
+        try:
+            message = json.loads(e.read())["error"]
+        except (ValueError, KeyError):
+            message = str(e)
+        raise ConnectionError(f"ingestion failed ({e.code}): {message}")
@@ -0,0 +1,216 @@
+"""
+Append-only local history of test runs, stored in SQLite
+Every run keeps its summary values in indexed columns and its raw samples and
+suitability statuses as JSON, so time range and server queries only touch the
+summary columns and stream rows instead of loading the whole store
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "cryos", "history.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    server_id TEXT,
+    server_host TEXT,
+    server_name TEXT,
+    ping REAL,
+    jitter REAL,
+    loss REAL,
+    download REAL,
+    upload REAL,
+    {metric_columns},
+    statuses TEXT NOT NULL,
+    samples TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS runs_server_timestamp ON runs (server_host, timestamp);
+"""
+
+# The other metrics the suitability rules check, so reports and fleet pushes
+# get them from the summary columns too
+METRIC_COLUMNS = ("bufferbloat", "ping_p50", "ping_p90", "ping_p99", "packet_loss", "loss_burst", "mos")
+
+SCHEMA = SCHEMA.format(metric_columns=",\n    ".join(f"{column} REAL" for column in METRIC_COLUMNS))
+
+SUMMARY_COLUMNS = ("id", "timestamp", "server_id", "server_host", "server_name",
+                   "ping", "jitter", "loss", "download", "upload") + METRIC_COLUMNS + ("statuses",)
+
+# Keys of a runner result that are stored as summary columns rather than samples
+SUMMARY_KEYS = ("timestamp", "server", "ping", "jitter", "loss", "download", "upload",
+                "analysis") + METRIC_COLUMNS
+
+
+def default_path():
+    return os.environ.get("CRYOS_HISTORY", DEFAULT_PATH)
+
+
+def to_epoch(value):
+    """
+    Accept epoch seconds, a datetime or an ISO 8601 string
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class HistoryStore:
+    """
+    SQLite backed run history
+    Connections are opened per call so one store can be shared between
+    Streamlit script threads, the CLI and the monitoring daemon
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection:
+            # WAL lets readers run while the monitor appends
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._add_metric_columns(connection)
+
+    def _add_metric_columns(self, connection):
+        """
+        Give a store from before METRIC_COLUMNS existed those columns, filled
+        from each run's samples
+        """
+        connection.execute("BEGIN IMMEDIATE")
+        existing = {row["name"] for row in connection.execute("PRAGMA table_info(runs)")}
+        missing = [column for column in METRIC_COLUMNS if column not in existing]
+        for column in missing:
+            connection.execute(f"ALTER TABLE runs ADD COLUMN {column} REAL")
+        if missing:
+            rows = connection.execute("SELECT id, samples FROM runs").fetchall()
+            updates = []
+            for row in rows:
+                samples = json.loads(row["samples"])
+                updates.append([samples.get(column) for column in missing] + [row["id"]])
+            assignments = ", ".join(f"{column} = ?" for column in missing)
+            connection.executemany(f"UPDATE runs SET {assignments} WHERE id = ?", updates)
+        connection.commit()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def append(self, result, analysis=None):
+        """
+        Record one runner result and return its run id
+        analysis defaults to result["analysis"]; only the statuses are kept
+        """
+        analysis = analysis if analysis is not None else result.get("analysis", [])
+        server = result.get("server") or {}
+        samples = {key: value for key, value in result.items() if key not in SUMMARY_KEYS}
+        statuses = {case["title"]: case["status"] for case in analysis}
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                f"INSERT INTO runs (timestamp, server_id, server_host, server_name, ping, jitter, loss,"
+                f" download, upload, {', '.join(METRIC_COLUMNS)}, statuses, samples)"
+                f" VALUES ({', '.join('?' for _ in range(11 + len(METRIC_COLUMNS)))})",
+                (
+                    to_epoch(result.get("timestamp")) or datetime.now(timezone.utc).timestamp(),
+                    None if server.get("id") is None else str(server.get("id")),
+                    server.get("host"),
+                    server.get("name"),
+                    result.get("ping"),
+                    result.get("jitter"),
+                    result.get("loss"),
+                    result.get("download"),
+                    result.get("upload"),
+                    *(result.get(column) for column in METRIC_COLUMNS),
+                    json.dumps(statuses, ensure_ascii=False),
+                    json.dumps(samples, ensure_ascii=False),
+                ),
+            )
+            return cursor.lastrowid
+
+    def _where(self, start, end, server):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(to_epoch(start))
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(to_epoch(end))
+        if server is not None:
+            clauses.append("server_host = ?")
+            params.append(server)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, start=None, end=None, server=None, limit=None, newest_first=False, batch_size=500,
+              after_id=None, order_by="timestamp", with_samples=False):
+        """
+        Yield summary rows (no raw samples) in time order, optionally filtered by a
+        [start, end) time range, server host and only runs with ids above after_id
+        order_by="id" yields them in insertion order instead; with_samples adds
+        the raw samples, as get() does
+        Rows are fetched in batches, so memory use does not grow with the store
+        """
+        if order_by not in ("timestamp", "id"):
+            raise ValueError(f"cannot order by {order_by!r}")
+        where, params = self._where(start, end, server)
+        if after_id is not None:
+            where += (" AND" if where else " WHERE") + " id > ?"
+            params.append(after_id)
+        columns = SUMMARY_COLUMNS + ("samples",) if with_samples else SUMMARY_COLUMNS
+        sql = f"SELECT {', '.join(columns)} FROM runs{where} ORDER BY {order_by}"
+        if newest_first:
+            sql += " DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(row)
+                    record["statuses"] = json.loads(record["statuses"])
+                    if with_samples:
+                        record["samples"] = json.loads(record["samples"])
+                    yield record
+
+    def count(self, start=None, end=None, server=None):
+        where, params = self._where(start, end, server)
+        with closing(self._connect()) as connection:
+            return connection.execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+
+    def get(self, run_id):
+        """
+        Return one full run, raw samples included, or None
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record["statuses"] = json.loads(record["statuses"])
+        record["samples"] = json.loads(record["samples"])
+        return record
+
+    def servers(self):
+        """
+        Distinct server hosts with their run counts, most used first
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT server_host, server_name, COUNT(*) AS runs FROM runs"
+                " GROUP BY server_host ORDER BY runs DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,175 @@
+"""
+Background test execution: a job queue served by one worker thread, so at
+most one test loads the link at a time and callers never block on a test
+A request for a test that is already queued or running joins that job
+instead of starting another; callers poll a job's state, progress and live
+throughput samples while it runs
+Finished results are cached per key for a freshness window, so viewers of a
+shared deployment reuse a recent test instead of loading the link again
+"""
+
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from cryos.throughput import SampleRing
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Seconds a finished result is served instead of running a new test
+DEFAULT_MAX_AGE = float(os.environ.get("CRYOS_RESULT_MAX_AGE", 300))
+
+
+class SpeedTestJob:
+    """
+    One test request and everything a poller needs to show it
+    """
+
+    def __init__(self, job_id, key, options):
+        self.id = job_id
+        self.key = key
+        self.options = options
+        self.state = QUEUED
+        self.progress = {"phase": "server", "fraction": 0.0, "message": "Waiting for the test to start..."}
+        self.samples = SampleRing()
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    def on_progress(self, phase, fraction, message):
+        # One dict swap, so a poller never sees a half-updated progress
+        self.progress = {"phase": phase, "fraction": fraction, "message": message}
+
+    @property
+    def age(self):
+        """
+        Seconds since the job finished, or None while it is active
+        """
+        return None if self.finished is None else time.time() - self.finished
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def snapshot(self):
+        return {"id": self.id, "key": self.key, "state": self.state, "progress": self.progress,
+                "error": None if self.error is None else str(self.error),
+                "created": self.created, "started": self.started, "finished": self.finished}
+
+
+class ResultCache:
+    """
+    The latest successful job per key, served while younger than max_age
+    seconds; at most max_entries keys are kept, least recently used first out
+    Not locked itself, the executor calls it under its lock
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, max_entries=16):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        job = self.entries.get(key)
+        if job is None:
+            return None
+        if job.age > self.max_age:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return job
+
+    def put(self, job):
+        self.entries[job.key] = job
+        self.entries.move_to_end(job.key)
+        # Drop expired results first, then the least recently used
+        for key in [key for key, old in self.entries.items() if old.age > self.max_age]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class SpeedTestExecutor:
+    """
+    Runs jobs one at a time on a daemon worker thread
+    run(on_progress=..., samples=..., **options) performs one test and returns
+    its result; jobs with the same key are de-duplicated while active, and
+    while cache holds a fresh result for the key it is returned instead of a
+    new job. The newest keep_jobs finished jobs stay available to pollers
+    """
+
+    def __init__(self, run, keep_jobs=32, cache=None):
+        self.run = run
+        self.keep_jobs = keep_jobs
+        self.cache = cache if cache is not None else ResultCache()
+        self.jobs = OrderedDict()
+        self.active = {}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.worker = threading.Thread(target=self.work, name="cryos-test-executor", daemon=True)
+        self.worker.start()
+
+    def submit(self, key, fresh=False, **options):
+        """
+        Queue a test, or return the queued or running job with the same key,
+        or unless fresh is set, the cached job that finished within max_age
+        """
+        with self.lock:
+            job = self.active.get(key)
+            if job is not None and job.active:
+                return job
+            job = None if fresh else self.cache.get(key)
+            if job is not None:
+                return job
+            job = SpeedTestJob(next(self.ids), key, options)
+            self.jobs[job.id] = job
+            self.active[key] = job
+            # Forget the oldest finished jobs
+            finished = [old.id for old in self.jobs.values() if not old.active]
+            for job_id in finished[:max(0, len(finished) - self.keep_jobs)]:
+                del self.jobs[job_id]
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def current(self):
+        """
+        The running job, else the oldest queued one, else None
+        """
+        with self.lock:
+            active = list(self.active.values())
+        running = [job for job in active if job.state == RUNNING]
+        return (running or sorted(active, key=lambda job: job.id) or [None])[0]
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            job.state, job.started = RUNNING, time.time()
+            try:
+                job.result = self.run(on_progress=job.on_progress, samples=job.samples, **job.options)
+                state = DONE
+            except Exception as e:
+                job.error, state = e, FAILED
+            # finished before state, so a job that no longer reads as active
+            # always has an age; submit() sees both change together
+            with self.lock:
+                job.finished = time.time()
+                job.state = state
+                if self.active.get(job.key) is job:
+                    del self.active[job.key]
+                if state == DONE:
+                    self.cache.put(job)
+            job.done.set()
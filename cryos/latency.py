@@ -0,0 +1,199 @@
+"""
+Latency probing against an already selected speedtest server, idle and while
+the throughput tests load the link
+"""
+
+import os
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlparse
+
+from cryos.stats import LatencyStats
+
+
+class LatencyConnection:
+    """
+    One kept-alive HTTP connection to a server's latency.txt; rtt() times a
+    single request in milliseconds and reconnects after a failure
+    """
+
+    def __init__(self, server, timeout=2.0):
+        parts = urlparse(os.path.dirname(server['url']))
+        self.connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self.netloc = parts.netloc
+        self.path = f"{parts.path}/latency.txt"
+        self.timeout = timeout
+        self.connection = None
+        self.headers = {'User-Agent': 'Cryos', 'Connection': 'keep-alive'}
+
+    def rtt(self, stamp):
+        """
+        Round trip time of one probe in ms; raises OSError, HTTPException or
+        ValueError when it is lost
+        """
+        try:
+            if self.connection is None:
+                self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+                # Open the socket up front so the TCP handshake is not timed
+                self.connection.connect()
+            start = time.perf_counter()
+            self.connection.request("GET", f"{self.path}?x={stamp}", headers=self.headers)
+            response = self.connection.getresponse()
+            body = response.read()
+            rtt = (time.perf_counter() - start) * 1000.0
+            if response.status != 200 or not body.startswith(b"test=test"):
+                raise ValueError(f"unexpected latency.txt response ({response.status})")
+            return rtt
+        except (OSError, HTTPException, ValueError):
+            # Reconnect for the next probe
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def probe_latency(server, num_probes=10, interval=0.0, timeout=2.0, keep_samples=True):
+    """
+    Send lightweight HTTP probes for latency.txt to a speedtest server over a
+    single kept-alive connection and collect the round trip times
+    Returns a dict with the per-probe RTTs (None for lost probes), mean,
+    p50/p90/p99, RFC 3550 style interarrival jitter and the loss ratio, all
+    times in milliseconds
+    The statistics are streamed through a quantile sketch; with keep_samples
+    False the raw RTTs aren't kept either, so long runs use constant memory
+    """
+    probe = LatencyConnection(server, timeout)
+    stats = LatencyStats()
+    samples = []
+    stamp = int(time.time() * 1000)
+    try:
+        # Warm-up request so connection setup does not skew the first sample
+        try:
+            probe.rtt(f"{stamp}.w")
+        except (OSError, HTTPException, ValueError):
+            pass
+
+        for i in range(num_probes):
+            try:
+                rtt = probe.rtt(f"{stamp}.{i}")
+            except (OSError, HTTPException, ValueError):
+                # A failed probe counts as lost
+                rtt = None
+            stats.add(rtt)
+            if keep_samples:
+                samples.append(rtt)
+            if interval and i < num_probes - 1:
+                time.sleep(interval)
+    finally:
+        probe.close()
+
+    summary = stats.summary()
+    return {
+        "samples": samples if keep_samples else None,
+        "mean": summary["mean"],
+        "p50": summary["p50"],
+        "p90": summary["p90"],
+        "p99": summary["p99"],
+        "jitter": summary["jitter"],
+        "loss": summary["loss"],
+    }
+
+
+# (upper bound of the added latency in ms, grade); the same bands the common
+# bufferbloat tests use
+BUFFERBLOAT_GRADES = ((5.0, "A+"), (30.0, "A"), (60.0, "B"), (200.0, "C"), (400.0, "D"))
+
+
+def bufferbloat_grade(increase):
+    """
+    Letter grade for the latency added under load, in ms
+    """
+    if increase is None:
+        return None
+    for limit, grade in BUFFERBLOAT_GRADES:
+        if increase < limit:
+            return grade
+    return "F"
+
+
+class LoadedLatencyProber:
+    """
+    Probes latency on its own connection in a background thread while the
+    throughput transfers run, adding every sample to the current phase's
+    streaming statistics
+    One small request per interval is a few hundred bytes a second, nothing
+    next to the transfer being measured
+    """
+
+    def __init__(self, server, interval=0.2, timeout=2.0):
+        self.probe = LatencyConnection(server, timeout)
+        self.interval = interval
+        self.phase = None
+        self.stats = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self, phase):
+        self.set_phase(phase)
+        self.thread.start()
+
+    def set_phase(self, phase):
+        self.stats.setdefault(phase, LatencyStats())
+        self.phase = phase
+
+    def run(self):
+        stamp = int(time.time() * 1000)
+        i = 0
+        while not self.stop_event.is_set():
+            phase = self.phase
+            try:
+                rtt = self.probe.rtt(f"{stamp}.l{i}")
+            except (OSError, HTTPException, ValueError):
+                rtt = None
+            if not self.stop_event.is_set():
+                self.stats[phase].add(rtt)
+            i += 1
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        """
+        Stop probing and return the LatencyStats per phase
+        """
+        self.stop_event.set()
+        if self.thread.ident is not None:
+            self.thread.join(self.probe.timeout + 1.0)
+        self.probe.close()
+        return self.stats
+
+
+def loaded_latency_report(idle, loaded):
+    """
+    Idle and per-phase RTT percentiles plus the bufferbloat: the worst
+    increase of a loaded median over the idle median, and its grade
+    idle and the values of loaded are LatencyStats
+    """
+    report = {"idle": idle.summary()}
+    increases = []
+    for phase, stats in loaded.items():
+        report[phase] = stats.summary()
+        if report[phase]["p50"] is not None and report["idle"]["p50"] is not None:
+            increases.append(max(0.0, report[phase]["p50"] - report["idle"]["p50"]))
+    report["increase"] = max(increases) if increases else None
+    report["grade"] = bufferbloat_grade(report["increase"])
+    return report
+
+
+def measure_jitter(server, num_pings=10):
+    """
+    Measure ping and jitter against the server picked by the main test flow
+    Probes reuse one connection instead of re-running server discovery per sample
+    Raises ConnectionError when every probe was lost
+    """
+    result = probe_latency(server, num_probes=num_pings)
+    if result["mean"] is None:
+        raise ConnectionError("all latency probes were lost")
+    return result["mean"], result["jitter"]
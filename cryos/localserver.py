@@ -0,0 +1,310 @@
+"""
+Local stand-in for a speedtest.net server, for offline and reproducible runs
+Implements the endpoints speedtest-cli and Cryos use (config, server list,
+latency.txt, random*.jpg downloads and upload.php) with optional bandwidth
+shaping and added latency/jitter, so the tool can be measured at known link rates
+A UDP echo on the same port number is the counterpart for cryos.realtime
+"""
+
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Byte sizes of the random{size}x{size}.jpg images on real speedtest servers
+IMAGE_SIZES = {
+    350: 245388,
+    500: 505544,
+    750: 1118012,
+    1000: 1986284,
+    1500: 4468241,
+    2000: 7907740,
+    2500: 12407926,
+    3000: 17816816,
+    3500: 24262167,
+    4000: 31625365,
+}
+
+CONFIG_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<settings>
+<client ip="{ip}" lat="0.0" lon="0.0" isp="Cryos local server" isprating="3.7" rating="0" ispdlavg="0" ispulavg="0" loggedin="0" country="ZZ" />
+<server-config threadcount="4" ignoreids="" notonmap="" forcepingid="" preferredserverid="" />
+<download testlength="10" initialtest="250K" mintestsize="250K" threadsperurl="4" />
+<upload testlength="10" ratio="5" initialtest="0" mintestsize="32K" threads="2" maxchunksize="512K" maxchunkcount="50" threadsperurl="4" />
+</settings>
+"""
+
+SERVERS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<settings>
+<servers>
+<server url="{url}" lat="0.0" lon="0.0" name="Localhost" country="Local" cc="ZZ" sponsor="Cryos" id="1" host="{host}" />
+</servers>
+</settings>
+"""
+
+IMAGE_PATH = re.compile(r"^/speedtest/random(\d+)x(\d+)\.jpg$")
+
+# Payload block the download responses are cut from
+BLOCK = os.urandom(1 << 20)
+CHUNK_SIZE = 65536
+
+
+class TokenBucket:
+    """
+    Thread-safe rate limiter for a byte rate shared by all connections
+    Works as a virtual clock: every consume() books the next n / rate seconds of
+    the link, with up to burst bytes of credit saved up while idle
+    A rate of None means unlimited
+    """
+
+    def __init__(self, rate_mbps, burst=CHUNK_SIZE * 4):
+        self.rate = rate_mbps * 1_000_000 / 8 if rate_mbps else None
+        self.burst = burst
+        self.next_free = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        """
+        Block until n bytes may be sent
+        """
+        if self.rate is None:
+            return
+        with self.lock:
+            now = time.perf_counter()
+            self.next_free = max(self.next_free, now - self.burst / self.rate) + n / self.rate
+            wait = self.next_free - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SpeedtestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "CryosLocal/1.0"
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # client's delayed ACK would add ~40 ms to every small response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def delay(self):
+        """
+        Sleep for the configured latency plus a uniformly distributed jitter
+        """
+        latency, jitter = self.server.latency_ms, self.server.jitter_ms
+        if latency or jitter:
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)) / 1000.0)
+
+    def send_body(self, body, content_type="text/plain"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.delay()
+        if path == "/speedtest-config.php":
+            self.send_body(CONFIG_XML.format(ip=self.client_address[0]).encode(), "text/xml")
+        elif path in ("/speedtest-servers-static.php", "/speedtest-servers.php"):
+            self.send_body(SERVERS_XML.format(url=self.server.upload_url, host=self.server.host).encode(),
+                           "text/xml")
+        elif path == "/speedtest/latency.txt":
+            self.send_body(b"test=test\n")
+        elif IMAGE_PATH.match(path):
+            self.send_image(int(IMAGE_PATH.match(path).group(1)))
+        else:
+            self.send_error(404)
+
+    def send_image(self, size):
+        length = IMAGE_SIZES.get(size)
+        if length is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        block = memoryview(BLOCK)
+        sent = 0
+        while sent < length:
+            n = min(CHUNK_SIZE, length - sent)
+            self.server.download_bucket.consume(n)
+            offset = sent % len(BLOCK)
+            n = min(n, len(BLOCK) - offset)
+            self.wfile.write(block[offset:offset + n])
+            sent += n
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/speedtest/upload.php":
+            self.send_error(404)
+            return
+        remaining = int(self.headers.get("Content-Length", 0))
+        received = 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            self.server.upload_bucket.consume(len(chunk))
+            received += len(chunk)
+            remaining -= len(chunk)
+        self.delay()
+        self.send_body(f"size={received}".encode())
+
+
+class LocalSpeedtestServer(ThreadingHTTPServer):
+    """
+    Speedtest protocol server on a local port, usable as a context manager
+    download_mbps/upload_mbps cap the aggregate rate of each direction and
+    latency_ms/jitter_ms are added to every response
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, download_mbps=None, upload_mbps=None,
+                 latency_ms=0.0, jitter_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.download_mbps = download_mbps
+        self.upload_mbps = upload_mbps
+        self.download_bucket = TokenBucket(download_mbps)
+        self.upload_bucket = TokenBucket(upload_mbps)
+        self._thread = None
+        super().__init__((host, port), SpeedtestHandler)
+
+    @property
+    def host(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def upload_url(self):
+        return f"http://{self.host}/speedtest/upload.php"
+
+    @property
+    def speedtest_server(self):
+        """
+        The server entry in the same shape speedtest-cli's get_best_server returns
+        """
+        return {
+            "url": self.upload_url,
+            "lat": "0.0",
+            "lon": "0.0",
+            "name": "Localhost",
+            "country": "Local",
+            "cc": "ZZ",
+            "sponsor": "Cryos",
+            "id": "1",
+            "host": self.host,
+            "d": 0.0,
+            "latency": self.latency_ms,
+        }
+
+    def server_bind(self):
+        if self.upload_bucket.rate is not None:
+            # Shaping happens above the kernel; a large receive buffer would
+            # let clients push megabytes past it. Set on the listening socket
+            # so accepted connections advertise the small window from the start
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CHUNK_SIZE)
+        super().server_bind()
+
+    def handle_error(self, request, client_address):
+        # Clients hang up mid-transfer whenever a timed test ends
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class UdpEchoServer:
+    """
+    Echoes every datagram back to its sender, usable as a context manager
+    loss drops that share of packets, to rehearse lossy links: independently
+    with burst=1, otherwise in bursts of burst packets on average (a two state
+    Gilbert model, which needs loss <= burst / (burst + 1))
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, loss=0.0, burst=1.0):
+        if not 0 <= loss < 1:
+            raise ValueError("loss must be in [0, 1)")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        if burst == 1:
+            # Bernoulli loss: the same chance whatever happened before
+            self.enter = self.stay = loss
+        else:
+            # Chance of entering the lossy state, and of staying in it
+            self.enter = loss / (burst * (1 - loss))
+            self.stay = 1 - 1 / burst
+            if self.enter > 1:
+                raise ValueError(f"a loss of {loss} needs bursts of at least {loss / (1 - loss):.2f} packets")
+        self.losing = False
+        family = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0][0]
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.2)
+        self.stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.socket.getsockname()[:2]
+
+    def drop(self):
+        self.losing = random.random() < (self.stay if self.losing else self.enter)
+        return self.losing
+
+    def serve_forever(self):
+        while not self.stopping.is_set():
+            try:
+                data, peer = self.socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.stopping.is_set():
+                    break
+                continue
+            if not self.drop():
+                try:
+                    self.socket.sendto(data, peer)
+                except OSError:
+                    pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
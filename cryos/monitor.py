@@ -0,0 +1,203 @@
+"""
+Continuous monitoring: cheap latency probes on a short schedule, an occasional
+full throughput test within a bandwidth budget, and suitability verdicts
+re-evaluated for every time window
+"""
+
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+
+from cryos.latency import probe_latency
+from cryos.runner import run_speed_test
+from cryos.stats import LatencyStats
+from cryos.suitability import analyze
+
+# Smallest budget a full test is run with; below it the capped transfers would
+# end within their first intervals and say little about the link
+MIN_FULL_BYTES = 10_000_000
+
+
+class BandwidthBudget:
+    """
+    Token bucket capping the bytes the monitoring itself may move
+    Holds at most budget_bytes and refills at budget_bytes per period seconds;
+    a budget of None means unlimited
+    """
+
+    def __init__(self, budget_bytes, period):
+        self.capacity = budget_bytes
+        self.rate = budget_bytes / period if budget_bytes else None
+        self.tokens = budget_bytes
+        self.updated = time.monotonic()
+
+    def available(self):
+        if self.capacity is None:
+            return float("inf")
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def spend(self, n):
+        if self.capacity is not None:
+            self.available()
+            self.tokens -= n
+
+
+def summarize_window(start, end, probes, last_full):
+    """
+    Build the verdict for one window from its latency probes and the most
+    recent full test
+    Medians keep a single congested probe from flipping the verdict; the
+    percentiles are over every RTT sample in the window
+    """
+    means = [probe["ping"] for probe in probes if probe["ping"] is not None]
+    stats = LatencyStats()
+    for probe in probes:
+        for rtt in probe.get("latency_samples") or ():
+            stats.add(rtt)
+    window = {
+        "type": "window",
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "probes": len(probes),
+        "ping": statistics.median(means) if means else None,
+        "jitter": statistics.median(probe["jitter"] for probe in probes) if means else None,
+        "loss": statistics.mean(probe["loss"] for probe in probes) if probes else None,
+        "ping_p50": stats.percentile(50),
+        "ping_p90": stats.percentile(90),
+        "ping_p99": stats.percentile(99),
+        "download": last_full["download"] if last_full else None,
+        "upload": last_full["upload"] if last_full else None,
+        "throughput_at": last_full["timestamp"] if last_full else None,
+    }
+    window["analysis"] = {case["title"]: case["status"] for case in analyze(window)}
+    return window
+
+
+class Monitor:
+    """
+    Scheduler for the monitoring daemon
+    Every probe_interval seconds a latency probe runs; every full_interval
+    seconds a full test runs if the bandwidth budget holds at least
+    min_full_bytes, with its transfers capped to what the budget holds. All
+    runs go to the history store and on_event receives every run and window
+    verdict
+    """
+
+    def __init__(self, server, store=None, probe_interval=60.0, full_interval=3600.0, window=900.0,
+                 pings=10, budget_bytes=None, budget_period=86400.0, on_event=None,
+                 throughput_options=None, min_full_bytes=MIN_FULL_BYTES):
+        if probe_interval <= 0 or full_interval <= 0 or window <= 0:
+            raise ValueError("intervals must be positive")
+        self.server = server
+        self.store = store
+        self.probe_interval = probe_interval
+        self.full_interval = full_interval
+        self.window = window
+        self.pings = pings
+        self.budget = BandwidthBudget(budget_bytes, budget_period)
+        self.min_full_bytes = min_full_bytes
+        self.on_event = on_event or (lambda event: None)
+        self.throughput_options = throughput_options or {}
+        self.stop_event = threading.Event()
+        self.last_full = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def record(self, result):
+        result["analysis"] = analyze(result)
+        if self.store is not None:
+            result["run_id"] = self.store.append(result)
+        self.on_event(result)
+
+    def probe(self):
+        latency = probe_latency(self.server, num_probes=self.pings)
+        result = {
+            "type": "probe",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "server": self.server,
+            "ping": latency["mean"],
+            "jitter": latency["jitter"],
+            "loss": latency["loss"],
+            "ping_p50": latency["p50"],
+            "ping_p90": latency["p90"],
+            "ping_p99": latency["p99"],
+            "latency_samples": latency["samples"],
+            "download": None,
+            "upload": None,
+        }
+        self.record(result)
+        return result
+
+    def full_test(self):
+        """
+        Run a full test if the budget allows it; returns the result or None
+        """
+        available = self.budget.available()
+        if available < self.min_full_bytes:
+            self.on_event({"type": "skipped", "timestamp": datetime.now(timezone.utc).isoformat(),
+                           "reason": "bandwidth budget exhausted",
+                           "available_bytes": available, "needed_bytes": self.min_full_bytes})
+            return None
+        options = dict(self.throughput_options)
+        if self.budget.capacity is not None:
+            # Each direction may use half of what the budget holds now
+            options["max_bytes"] = available / 2
+        result = run_speed_test(num_pings=self.pings, server=self.server, **options)
+        moved = sum(transfer["bytes"] for transfer in result["transfers"].values())
+        self.budget.spend(moved)
+        result["type"] = "full"
+        self.record(result)
+        self.last_full = result
+        return result
+
+    def run(self, iterations=None):
+        """
+        Run until stop() is called, or for the given number of probe rounds
+        """
+        now = time.monotonic()
+        next_probe, next_full = now, now
+        window_start = datetime.now(timezone.utc)
+        window_end_at = now + self.window
+        window_probes = []
+        rounds = 0
+
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_full:
+                next_full = now + self.full_interval
+                try:
+                    result = self.full_test()
+                    if result is not None:
+                        window_probes.append(result)
+                        # A full test includes a latency measurement
+                        next_probe = now + self.probe_interval
+                except Exception as e:
+                    self.on_event({"type": "error", "phase": "full", "error": str(e)})
+            if now >= next_probe:
+                next_probe = now + self.probe_interval
+                try:
+                    window_probes.append(self.probe())
+                except Exception as e:
+                    self.on_event({"type": "error", "phase": "probe", "error": str(e)})
+                rounds += 1
+
+            now = time.monotonic()
+            if now >= window_end_at:
+                window_end = datetime.now(timezone.utc)
+                self.on_event(summarize_window(window_start, window_end, window_probes, self.last_full))
+                window_start, window_probes = window_end, []
+                window_end_at = now + self.window
+
+            if iterations is not None and rounds >= iterations:
+                break
+            # Sleep until whatever is due next; nothing runs in between
+            self.stop_event.wait(max(0.0, min(next_probe, next_full, window_end_at) - time.monotonic()))
+
+        if window_probes:
+            self.on_event(summarize_window(window_start, datetime.now(timezone.utc), window_probes,
+                                           self.last_full))
@@ -0,0 +1,158 @@
+"""
+Phase profiling: a Tracer records one span per phase of a test run (wall time
+plus bytes moved, request counts or anything else the phase knows) and
+exports them as JSON or in the Chrome trace event format, which
+chrome://tracing and Perfetto open directly
+Tracing is off unless a Tracer is passed in; the default NULL_TRACER hands out
+one shared do-nothing span, so disabled tracing costs a method call per phase
+"""
+
+import json
+import os
+import threading
+import time
+
+
+def enabled():
+    """
+    Whether $CRYOS_PROFILE asks for tracing
+    """
+    return os.environ.get("CRYOS_PROFILE", "").lower() not in ("", "0", "false", "no")
+
+
+class Span:
+    """
+    One timed phase; use as a context manager (or begin() and finish() when
+    the phase doesn't fit in a block) and set() what it moved
+    """
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+        self.start = None
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def begin(self):
+        self.start = time.perf_counter()
+        return self
+
+    def finish(self):
+        self.end = time.perf_counter()
+        self.tracer.record(self)
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.attrs["error"] = repr(exc)
+        self.finish()
+
+    @property
+    def seconds(self):
+        return self.end - self.start
+
+
+class NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def begin(self):
+        return self
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+class NullTracer:
+    """
+    The disabled tracer
+    """
+
+    active = False
+    _span = NullSpan()
+
+    def span(self, name, **attrs):
+        return self._span
+
+    def record(self, span):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer:
+    """
+    Collects finished spans from any thread
+    """
+
+    active = True
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        """
+        JSON serializable spans ordered by start, times in ms from the first
+        tracer's creation
+        """
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            "started": self.wall_origin,
+            "spans": [{"name": span.name, "thread": span.thread,
+                       "start_ms": (span.start - self.origin) * 1000.0,
+                       "duration_ms": span.seconds * 1000.0, **span.attrs}
+                      for span in spans],
+        }
+
+    def chrome_trace(self):
+        return chrome_trace(self.to_dict())
+
+    def dump(self, path, chrome=True):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace() if chrome else self.to_dict(), f)
+
+
+def chrome_trace(*timings):
+    """
+    Tracer.to_dict() outputs (e.g. a test run's and a page run's) as one
+    Chrome trace of "complete" events, aligned on their wall clock starts
+    """
+    origin = min((t["started"] for t in timings), default=0.0)
+    threads = {}
+    events = []
+    for timing in timings:
+        offset = (timing["started"] - origin) * 1000.0
+        for span in timing["spans"]:
+            tid = threads.setdefault(span["thread"], len(threads) + 1)
+            args = {key: value for key, value in span.items()
+                    if key not in ("name", "thread", "start_ms", "duration_ms")}
+            events.append({"name": span["name"], "cat": "cryos", "ph": "X", "pid": 1, "tid": tid,
+                           "ts": (offset + span["start_ms"]) * 1000.0, "dur": span["duration_ms"] * 1000.0,
+                           "args": args})
+    events += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+               for name, tid in threads.items()]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,197 @@
+"""
+Real-time traffic simulation: a paced stream of small UDP packets, like a VoIP
+call or a game's state updates, sent to an echo counterpart (`cryos serve`
+answers on its HTTP port number) to measure what mean ping and jitter hide:
+packet loss, reordering, loss bursts and the call quality they leave (MOS,
+from the ITU-T G.107 E-model)
+Per-packet times go into preallocated arrays, so a stream costs 16 bytes per
+packet and nothing else grows while it runs
+"""
+
+import array
+import math
+import random
+import socket
+import struct
+import threading
+import time
+
+from cryos.stats import LatencyStats
+
+# Sequence number and stream token; the rest of the payload is padding
+HEADER = struct.Struct("!II")
+
+# E-model equipment impairment and packet-loss robustness of G.711 with packet
+# loss concealment (ITU-T G.113 Appendix I)
+CODEC_IE = 0.0
+CODEC_BPL = 25.1
+
+
+def parse_target(text):
+    """
+    "host:port" (or "[v6 address]:port") -> (host, port)
+    """
+    host, sep, port = text.rpartition(":")
+    if not sep or not host or not port.isdigit():
+        raise ValueError(f"expected HOST:PORT, got {text!r}")
+    return host.strip("[]"), int(port)
+
+
+def r_factor(rtt, jitter, loss, burst_ratio=1.0, packet_interval=20.0):
+    """
+    Simplified E-model rating for a voice stream
+    rtt, jitter and packet_interval in ms, loss as a fraction; the one-way
+    mouth-to-ear delay is half the RTT plus a jitter buffer of twice the jitter
+    plus one packet of packetization
+    """
+    delay = rtt / 2 + 2 * jitter + packet_interval
+    # Delay impairment (Cole and Rosenbluth's fit of G.107)
+    delay_impairment = 0.024 * delay + (0.11 * (delay - 177.3) if delay > 177.3 else 0.0)
+    # Effective equipment impairment with burst-sensitive loss (G.107 7.2)
+    ppl = loss * 100.0
+    equipment = CODEC_IE + (95 - CODEC_IE) * ppl / (ppl / burst_ratio + CODEC_BPL)
+    return 93.2 - delay_impairment - equipment
+
+
+def mos_from_r(r):
+    """
+    Mean opinion score (1 to 4.5) for an E-model rating
+    """
+    if r <= 0:
+        return 1.0
+    if r >= 100:
+        return 4.5
+    return 1 + 0.035 * r + 7e-6 * r * (r - 60) * (100 - r)
+
+
+def loss_pattern(received):
+    """
+    Burst structure of a loss sequence (received is a sequence of booleans)
+    Returns the number of loss bursts, the longest and mean burst length and
+    the burst ratio: mean burst length over what random loss at the same rate
+    would give (1 is random, above 1 bursty)
+    """
+    bursts, longest, run = 0, 0, 0
+    # Transitions of the two state (Gilbert) model
+    after_received = lost_after_received = after_lost = received_after_lost = 0
+    previous = True
+    for ok in received:
+        if previous:
+            after_received += 1
+            lost_after_received += not ok
+        else:
+            after_lost += 1
+            received_after_lost += ok
+        if ok:
+            run = 0
+        else:
+            if run == 0:
+                bursts += 1
+            run += 1
+            longest = max(longest, run)
+        previous = ok
+    lost = len(received) - sum(received)
+    p = lost_after_received / after_received if after_received else 0.0
+    q = received_after_lost / after_lost if after_lost else 1.0
+    return {
+        "bursts": bursts,
+        "max_burst": longest,
+        "mean_burst": lost / bursts if bursts else 0.0,
+        "burst_ratio": 1.0 / (p + q) if p + q > 0 else 1.0,
+    }
+
+
+def simulate_stream(host, port, rate=50.0, duration=30.0, payload=160, timeout=1.0):
+    """
+    Send rate packets per second of payload bytes for duration seconds to a
+    UDP echo server and time every echo
+    Returns loss and reorder ratios, duplicates, the loss burst structure, RTT
+    statistics (ms) and the estimated R-factor and MOS of a call over the path
+    """
+    if rate <= 0 or duration <= 0:
+        raise ValueError("rate and duration must be positive")
+    count = max(1, int(rate * duration))
+    payload = max(payload, HEADER.size)
+    token = random.getrandbits(32)
+    sent_at = array.array("d", bytes(8 * count))
+    rtts = array.array("d", [math.nan]) * count
+    arrivals = {"highest": -1, "reordered": 0, "duplicates": 0}
+    stop = threading.Event()
+
+    family, kind, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, kind, proto)
+    sock.settimeout(0.1)
+    sock.connect(address)
+
+    def receive():
+        while not stop.is_set():
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                # e.g. ICMP port unreachable; the packet just counts as lost
+                continue
+            arrived = time.perf_counter()
+            if len(data) < HEADER.size:
+                continue
+            seq, stream = HEADER.unpack_from(data)
+            if stream != token or seq >= count:
+                continue
+            if not math.isnan(rtts[seq]):
+                arrivals["duplicates"] += 1
+                continue
+            rtts[seq] = (arrived - sent_at[seq]) * 1000.0
+            if seq < arrivals["highest"]:
+                arrivals["reordered"] += 1
+            else:
+                arrivals["highest"] = seq
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    padding = bytes(payload - HEADER.size)
+    try:
+        started = time.perf_counter()
+        for seq in range(count):
+            # Paced on an absolute schedule so sleep overshoot doesn't accumulate
+            delay = started + seq / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sent_at[seq] = time.perf_counter()
+            try:
+                sock.send(HEADER.pack(seq, token) + padding)
+            except OSError:
+                pass
+        time.sleep(timeout)
+    finally:
+        stop.set()
+        receiver.join()
+        sock.close()
+
+    received = [not math.isnan(rtt) for rtt in rtts]
+    stats = LatencyStats()
+    for rtt in rtts:
+        stats.add(None if math.isnan(rtt) else rtt)
+    summary = stats.summary()
+    pattern = loss_pattern(received)
+    if stats.received:
+        rating = r_factor(summary["mean"], summary["jitter"], summary["loss"], pattern["burst_ratio"],
+                          1000.0 / rate)
+        mos = mos_from_r(rating)
+    else:
+        rating, mos = None, None
+    return {
+        "target": f"{host}:{port}",
+        "rate": rate,
+        "duration": duration,
+        "payload": payload,
+        "sent": count,
+        "received": stats.received,
+        "loss": summary["loss"],
+        "reordered": arrivals["reordered"] / stats.received if stats.received else 0.0,
+        "duplicates": arrivals["duplicates"],
+        **pattern,
+        "rtt": summary,
+        "r_factor": rating,
+        "mos": mos,
+    }
@@ -0,0 +1,134 @@
+"""
+Rendering helpers for the Streamlit app: the Plotly gauges and the use case cards
+Importing this module pulls in Plotly, so the headless core never imports it
+"""
+
+import threading
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+
+# Finished gauges for the most recent (gauge, value) pairs; a rerun with
+# unchanged values gets the same figure back without building anything
+FIGURE_CACHE_SIZE = 64
+
+_templates = {}
+_figures = OrderedDict()
+_lock = threading.Lock()
+
+
+def build_gauge_template(max_value, title, units, color_scale, is_inverse=False):
+    """
+    Build and validate the full gauge figure once, with a placeholder value,
+    and return it as a plain figure dict
+    is_inverse=True means lower values are better (for ping and jitter)
+    """
+    # For inverse metrics (ping, jitter), reverse the color scale
+    if is_inverse:
+        color_scale = color_scale[::-1]
+
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number+delta",
+        value=0,
+        domain={'x': [0, 1], 'y': [0, 1]},
+        title={'text': title, 'font': {'size': 24, 'color': '#00FFFF'}},
+        delta={'reference': max_value/2,
+               'increasing': {'color': "#00FFFF" if not is_inverse else "#FF5555"},
+               'decreasing': {'color': "#00FFFF" if is_inverse else "#FF5555"}},
+        gauge={
+            'axis': {'range': [None, max_value], 'tickwidth': 1, 'tickcolor': "white"},
+            'bar': {'color': "#00FFFF"},
+            'bgcolor': "rgba(0,0,0,0)",
+            'borderwidth': 2,
+            'bordercolor': "gray",
+            'steps': [
+                {'range': [0, max_value/3], 'color': color_scale[0]},
+                {'range': [max_value/3, 2*max_value/3], 'color': color_scale[1]},
+                {'range': [2*max_value/3, max_value], 'color': color_scale[2]}
+            ],
+            'threshold': {
+                'line': {'color': "white", 'width': 4},
+                'thickness': 0.75,
+                'value': 0
+            }
+        }
+    ))
+
+    fig.update_layout(
+        height=300,
+        margin=dict(l=20, r=20, t=50, b=20),
+        paper_bgcolor="rgba(0,0,0,0)",
+        font={'color': "white", 'family': "Arial"},
+        annotations=[
+            dict(
+                text=f"{units}",
+                x=0.5,
+                y=0.25,
+                font=dict(size=16, color="#00FFFF"),
+                showarrow=False,
+                xanchor="center"
+            )
+        ]
+    )
+    return fig.to_dict()
+
+
+def create_speedometer(value, max_value, title, units, color_scale, is_inverse=False):
+    """
+    Create a speedometer gauge with proper color scaling
+    is_inverse=True means lower values are better (for ping and jitter)
+    The layout is built once per gauge and only the value and threshold are
+    patched in per call. The returned figure may be shared between calls, so
+    treat it as read-only
+    """
+    key = (title, max_value, units, tuple(color_scale), is_inverse)
+    with _lock:
+        fig = _figures.get((key, value))
+        if fig is not None:
+            _figures.move_to_end((key, value))
+            return fig
+        template = _templates.get(key)
+    if template is None:
+        template = build_gauge_template(max_value, title, units, list(color_scale), is_inverse)
+
+    # Copy only the dicts on the path to the patched values; the rest of the
+    # template is shared, which is safe because Figure copies what it is given
+    trace = dict(template["data"][0], value=value)
+    trace["gauge"] = dict(trace["gauge"], threshold=dict(trace["gauge"]["threshold"], value=value))
+    # The template was validated when it was built and only two numbers
+    # changed, so skip plotly's validation pass, which dominates build time
+    fig = go.Figure({"data": [trace], "layout": template["layout"]}, _validate=False)
+
+    with _lock:
+        _templates[key] = template
+        _figures[(key, value)] = fig
+        while len(_figures) > FIGURE_CACHE_SIZE:
+            _figures.popitem(last=False)
+    return fig
+
+
+def create_use_case_card(title, icon, status, message):
+    # Determine styling and message
+    if status == "good":
+        color = "#00FF00"
+        emoji = "✅"
+        bg_color = "rgba(0, 100, 0, 0.3)"
+    elif status == "moderate":
+        color = "#FFAA00"
+        emoji = "⚠️"
+        bg_color = "rgba(100, 70, 0, 0.3)"
+    else:
+        color = "#FF0000"
+        emoji = "❌"
+        bg_color = "rgba(100, 0, 0, 0.3)"
+
+    return f"""
+        <div class="use-case-card" style="background: {bg_color};">
+            <div class="use-case-title">
+                {icon} {title} {emoji}
+            </div>
+            <div class="use-case-body">
+                {message}
+            </div>
+        </div>
+    """
@@ -0,0 +1,250 @@
+"""
+Declarative suitability rules: the use case table and the suggestion rules
+live in a JSON (or YAML) rule file that is validated and compiled once into an
+evaluation plan. Plans are cached per file and recompiled only when the file's
+modification time changes, so a site can edit its workload profiles in place
+"""
+
+import itertools
+import json
+import operator
+import os
+import threading
+import warnings
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+
+# Metrics a rule may check; anything else is almost certainly a typo
+METRICS = ("download", "upload", "ping", "jitter", "bufferbloat", "ping_p50", "ping_p90", "ping_p99",
+           "packet_loss", "loss_burst", "mos")
+
+STATUSES = ("good", "moderate", "bad")
+OPERATORS = {"below": operator.lt, "above": operator.gt}
+
+
+class RuleError(ValueError):
+    pass
+
+
+# Numbers compiled plans, so caches of rendered verdicts can tell plans apart
+_revisions = itertools.count(1)
+
+
+def default_path():
+    return os.environ.get("CRYOS_RULES", DEFAULT_PATH)
+
+
+def read_document(path):
+    """
+    Parse a rule file; YAML needs PyYAML, JSON needs nothing
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuleError(f"{path}: reading YAML rule files needs PyYAML (pip install pyyaml)")
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise RuleError(f"{path}: {e}")
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise RuleError(f"{path}: {e}")
+
+
+def _number(value, where):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RuleError(f"{where}: expected a number, got {value!r}")
+    return value
+
+
+def _text(entry, key, where):
+    value = entry.get(key)
+    if not isinstance(value, str):
+        raise RuleError(f"{where}: {key!r} must be a string")
+    return value
+
+
+def _metric(name, where):
+    if name not in METRICS:
+        raise RuleError(f"{where}: unknown metric {name!r} (expected one of {', '.join(METRICS)})")
+    return name
+
+
+def _list(document, key, default, where):
+    value = document.get(key, default)
+    if not isinstance(value, list):
+        raise RuleError(f"{where}: {key!r} must be a list")
+    return value
+
+
+class RulePlan:
+    """
+    A compiled rule file
+    use_cases keeps the original dicts (for display and for cryos.scoring);
+    the checks and suggestion rules are flattened into tuples so evaluating
+    a result is a straight loop with no lookups or validation left in it
+    """
+
+    def __init__(self, document, source=None):
+        where = source or "rules"
+        if not isinstance(document, dict):
+            raise RuleError(f"{where}: expected a mapping at the top level")
+        inverse = _list(document, "inverse_metrics", ["ping", "jitter"], where)
+        self.inverse_metrics = tuple(_metric(m, f"{where}: inverse_metrics") for m in inverse)
+        # Metrics not every result has (e.g. bufferbloat, which needs a loaded
+        # latency measurement); a check on one of them is skipped when absent
+        # instead of making the verdict unknown
+        optional = _list(document, "optional_metrics", [], where)
+        self.optional_metrics = tuple(_metric(m, f"{where}: optional_metrics") for m in optional)
+        self.source = source
+        self.revision = next(_revisions)
+
+        use_cases = document.get("use_cases")
+        if not isinstance(use_cases, list) or not use_cases:
+            raise RuleError(f"{where}: 'use_cases' must be a non-empty list")
+        self.use_cases = []
+        # (title, icon, ((metric, good, moderate, inverse, optional), ...), {status: message})
+        self.evaluators = []
+        for i, case in enumerate(use_cases):
+            at = f"{where}: use_cases[{i}]"
+            if not isinstance(case, dict):
+                raise RuleError(f"{at}: expected a mapping")
+            title, icon = _text(case, "title", at), _text(case, "icon", at)
+            messages = {status: _text(case, key, at)
+                        for status, key in zip(STATUSES, ("good_msg", "mod_msg", "bad_msg"))}
+            checks = case.get("checks")
+            if not isinstance(checks, dict) or not checks:
+                raise RuleError(f"{at}: 'checks' must be a non-empty mapping")
+            compiled = []
+            for metric, thresholds in checks.items():
+                _metric(metric, at)
+                if not isinstance(thresholds, (list, tuple)) or len(thresholds) != 2:
+                    raise RuleError(f"{at}: {metric} needs [good, moderate] thresholds")
+                good, moderate = (_number(t, f"{at}: {metric}") for t in thresholds)
+                is_inverse = metric in self.inverse_metrics
+                if (good > moderate) if is_inverse else (good < moderate):
+                    raise RuleError(f"{at}: {metric} good threshold {good} is worse than moderate {moderate}")
+                compiled.append((metric, good, moderate, is_inverse, metric in self.optional_metrics))
+            self.use_cases.append({"title": title, "icon": icon,
+                                   "checks": {m: [g, md] for m, g, md, _, _ in compiled},
+                                   "good_msg": messages["good"], "mod_msg": messages["moderate"],
+                                   "bad_msg": messages["bad"]})
+            self.evaluators.append((title, icon, tuple(compiled), messages))
+
+        # (metric, ((compare, threshold, suggestion), ...)) where the first
+        # matching case wins, or (None, suggestion) for unconditional advice
+        self.suggestion_rules = []
+        for i, rule in enumerate(_list(document, "suggestions", [], where)):
+            at = f"{where}: suggestions[{i}]"
+            if not isinstance(rule, dict):
+                raise RuleError(f"{at}: expected a mapping")
+            if "metric" not in rule:
+                self.suggestion_rules.append((None, self._suggestion(rule, at)))
+                continue
+            metric = _metric(rule["metric"], at)
+            cases = rule.get("cases")
+            if not isinstance(cases, list) or not cases:
+                raise RuleError(f"{at}: 'cases' must be a non-empty list")
+            compiled = []
+            for j, case in enumerate(cases):
+                case_at = f"{at}.cases[{j}]"
+                if not isinstance(case, dict):
+                    raise RuleError(f"{case_at}: expected a mapping")
+                conditions = [name for name in OPERATORS if name in case]
+                if len(conditions) != 1:
+                    raise RuleError(f"{case_at}: needs exactly one of {', '.join(OPERATORS)}")
+                compare = OPERATORS[conditions[0]]
+                threshold = _number(case[conditions[0]], case_at)
+                compiled.append((compare, threshold, self._suggestion(case, case_at)))
+            self.suggestion_rules.append((metric, tuple(compiled)))
+
+    @staticmethod
+    def _suggestion(entry, where):
+        return {key: _text(entry, key, where) for key in ("icon", "title", "content")}
+
+    def evaluate(self, result, checks):
+        """
+        Same combination as cryos.suitability.evaluate_use_case, over
+        compiled checks
+        """
+        status = "good"
+        missing = False
+        for metric, good, moderate, inverse, optional in checks:
+            value = result.get(metric)
+            if value is None:
+                missing = missing or not optional
+            elif (value > moderate) if inverse else (value < moderate):
+                return "bad"
+            elif (value > good) if inverse else (value < good):
+                status = "moderate"
+        return "unknown" if missing else status
+
+    def analyze(self, result):
+        analysis = []
+        for title, icon, checks, messages in self.evaluators:
+            status = self.evaluate(result, checks)
+            analysis.append({"title": title, "icon": icon, "status": status,
+                             "message": messages.get(status, "")})
+        return analysis
+
+    def suggestions(self, result):
+        suggestions = []
+        for metric, rule in self.suggestion_rules:
+            if metric is None:
+                suggestions.append(dict(rule))
+                continue
+            value = result.get(metric)
+            if value is None:
+                continue
+            for compare, threshold, suggestion in rule:
+                if compare(value, threshold):
+                    suggestions.append(dict(suggestion))
+                    break
+        return suggestions
+
+
+def compile_file(path):
+    return RulePlan(read_document(path), source=path)
+
+
+_plans = {}
+_lock = threading.Lock()
+
+
+def get_plan(path=None):
+    """
+    The compiled plan for a rule file (default: $CRYOS_RULES or the bundled
+    rules.json), recompiled only when the file's mtime changes
+    If an edited file fails to validate the previous plan stays in use, so a
+    bad edit never takes down a running app; the first load still raises
+    """
+    path = os.path.abspath(path or default_path())
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as e:
+        if path in _plans:
+            return _plans[path][1]
+        raise RuleError(f"{path}: {e.strerror}")
+    cached = _plans.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _lock:
+        cached = _plans.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            plan = compile_file(path)
+        # RuleError is a ValueError; TypeError guards shapes validation missed
+        except (ValueError, TypeError, OSError) as e:
+            if cached is None:
+                raise
+            warnings.warn(f"keeping the previous rules: {e}")
+            # Remember the bad mtime so the file isn't re-parsed on every call
+            _plans[path] = (mtime, cached[1])
+            return cached[1]
+        _plans[path] = (mtime, plan)
+        return plan
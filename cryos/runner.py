@@ -0,0 +1,137 @@
+"""
+The speed test sequence: server selection, latency, an optional real-time
+stream, download and upload
+"""
+
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from cryos.latency import LoadedLatencyProber, loaded_latency_report, probe_latency
+from cryos.profiling import NULL_TRACER
+from cryos.realtime import simulate_stream
+from cryos.servers import ServerSelector
+from cryos.stats import LatencyStats
+from cryos.throughput import do_nothing, measure_throughput
+
+
+def server_from_url(url):
+    """
+    Build a speedtest-cli style server entry for a known upload.php URL,
+    e.g. a local stand-in server, so discovery can be skipped
+    """
+    parts = urlparse(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise ValueError(f"not a speedtest server URL: {url}")
+    return {
+        "url": url,
+        "name": parts.hostname,
+        "country": "",
+        "sponsor": parts.netloc,
+        "id": "",
+        "host": parts.netloc,
+        "d": None,
+        "latency": None,
+    }
+
+
+def run_speed_test(num_pings=5, on_progress=do_nothing, server=None, selector=None, loaded_latency=True,
+                   tracer=NULL_TRACER, realtime=None, **throughput_options):
+    """
+    Run the full test sequence against the best speedtest.net server, or
+    against server (a speedtest-cli style server entry) when one is given
+    selector is the ServerSelector used for discovery (default: speedtest.net)
+    on_progress(phase, fraction, message) reports progress for each phase
+    loaded_latency keeps probing latency during the transfers to measure bufferbloat
+    tracer (a cryos.profiling.Tracer) gets a span per phase
+    realtime, keyword arguments for cryos.realtime.simulate_stream (host, port,
+    rate, duration...), also runs a paced UDP stream against that echo server
+    for packet loss, loss bursts and MOS
+    throughput_options are passed to measure_throughput (streams, duration,
+    warmup, chunk_size, download_size, upload_size, samples, tolerance,
+    min_duration)
+    Returns a JSON serializable dict with the server, latency samples and speeds
+    """
+    warnings = []
+
+    on_progress("server", 0.0, "Finding optimal server...")
+    with tracer.span("server", discovered=server is None) as span:
+        if server is None:
+            server = (selector or ServerSelector()).best()
+            span.set(cached=bool(server.get("cached")))
+    on_progress("server", 1.0, f"Selected server: {server['sponsor']} ({server['name']})")
+
+    on_progress("latency", 0.0, "Measuring ping and jitter...")
+    with tracer.span("latency", requests=num_pings + 1):
+        latency = probe_latency(server, num_probes=num_pings)
+    if latency["mean"] is None:
+        if server['latency'] is None:
+            raise ConnectionError("all latency probes were lost")
+        # Fall back to the latency measured during server selection
+        warnings.append("All latency probes were lost, using the server selection ping")
+        ping, jitter = server['latency'], 0.0
+    else:
+        ping, jitter = latency["mean"], latency["jitter"]
+    on_progress("latency", 1.0, f"Ping: {ping:.2f} ms, Jitter: {jitter:.2f} ms")
+
+    stream = None
+    if realtime is not None:
+        on_progress("realtime", 0.0, "Simulating a real-time stream...")
+        with tracer.span("realtime") as span:
+            stream = simulate_stream(**realtime)
+            span.set(requests=stream["sent"], bytes=stream["sent"] * stream["payload"])
+        if stream["received"] == 0:
+            warnings.append(f"No echoes from {stream['target']}; is a UDP echo server (cryos serve) running there?")
+            stream = None
+        else:
+            on_progress("realtime", 1.0, f"Packet loss: {stream['loss']:.1%}, MOS: {stream['mos']:.2f}")
+
+    transfers = {}
+    prober = LoadedLatencyProber(server) if loaded_latency else None
+    try:
+        for direction in ("download", "upload"):
+            if prober is not None:
+                if direction == "download":
+                    prober.start(direction)
+                else:
+                    prober.set_phase(direction)
+            with tracer.span(direction) as span:
+                transfers[direction] = measure_throughput(
+                    server, direction,
+                    on_progress=lambda fraction, message: on_progress(direction, fraction, message),
+                    **throughput_options
+                )
+                span.set(bytes=transfers[direction]["bytes"], requests=transfers[direction]["requests"],
+                         converged=transfers[direction]["converged"])
+            on_progress(direction, 1.0,
+                        f"{direction.capitalize()} speed: {transfers[direction]['mbps']:.2f} Mbps")
+    finally:
+        with tracer.span("loaded_latency_stop") as span:
+            loaded = prober.stop() if prober is not None else None
+            if loaded is not None:
+                span.set(requests=sum(stats.sent for stats in loaded.values()))
+    report = (loaded_latency_report(LatencyStats.from_samples(latency["samples"]), loaded)
+              if loaded is not None else None)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "server": {key: server.get(key) for key in
+                   ("id", "name", "country", "sponsor", "host", "url", "d", "latency", "cached")},
+        "ping": ping,
+        "jitter": jitter,
+        "loss": latency["loss"],
+        "ping_p50": latency["p50"],
+        "ping_p90": latency["p90"],
+        "ping_p99": latency["p99"],
+        "latency_samples": latency["samples"],
+        "download": transfers["download"]["mbps"],
+        "upload": transfers["upload"]["mbps"],
+        "bufferbloat": report["increase"] if report else None,
+        "loaded_latency": report,
+        # Loss in percent, to match the rule thresholds
+        "packet_loss": stream["loss"] * 100.0 if stream else None,
+        "loss_burst": stream["max_burst"] if stream else None,
+        "mos": stream["mos"] if stream else None,
+        "realtime": stream,
+        "transfers": transfers,
+        "warnings": warnings,
+    }
@@ -0,0 +1,172 @@
+"""
+Vectorized suitability scoring: the use case threshold table compiled into NumPy
+arrays, so a whole batch of measurements (a month of history, a fleet of
+probes) is scored against every use case in one pass
+Statuses and limiting metrics match cryos.suitability.evaluate_use_case cell for cell
+"""
+
+import numpy as np
+
+from cryos.rules import METRICS, get_plan
+from cryos.suitability import INVERSE_METRICS, OPTIONAL_METRICS, USE_CASES
+
+# Status codes, ordered so that a larger code is a worse status
+UNKNOWN, GOOD, MODERATE, BAD = -1, 0, 1, 2
+STATUS_NAMES = {UNKNOWN: "unknown", GOOD: "good", MODERATE: "moderate", BAD: "bad"}
+
+
+class CompiledRules:
+    """
+    A use case table as arrays: good and moderate thresholds of shape
+    (use cases, metrics), a mask of the checked cells and the inverse and
+    optional flags
+    """
+
+    def __init__(self, use_cases=USE_CASES, metrics=METRICS, inverse_metrics=INVERSE_METRICS,
+                 optional_metrics=OPTIONAL_METRICS):
+        self.titles = [case["title"] for case in use_cases]
+        self.metrics = tuple(metrics)
+        shape = (len(use_cases), len(self.metrics))
+        self.good = np.full(shape, np.nan)
+        self.moderate = np.full(shape, np.nan)
+        for i, case in enumerate(use_cases):
+            for metric, (good, moderate) in case["checks"].items():
+                if metric not in self.metrics:
+                    raise ValueError(f"use case {case['title']!r} checks unknown metric {metric!r}")
+                j = self.metrics.index(metric)
+                self.good[i, j], self.moderate[i, j] = good, moderate
+        self.checked = ~np.isnan(self.good)
+        self.inverse = np.array([metric in inverse_metrics for metric in self.metrics])
+        self.optional = np.array([metric in optional_metrics for metric in self.metrics])
+        # Flip the sign of inverse metrics so "higher is better" holds everywhere
+        self.sign = np.where(self.inverse, -1.0, 1.0)
+
+
+class Scores:
+    """
+    Result of scoring N measurements against U use cases
+    status: (N, U) int8 status codes; limiting: (N, U) index into metrics of
+    the metric that decided the status, -1 when every checked metric is good
+    """
+
+    def __init__(self, rules, status, limiting):
+        self.rules = rules
+        self.status = status
+        self.limiting = limiting
+
+    def status_names(self):
+        names = np.array(["unknown", "good", "moderate", "bad"])
+        return names[self.status + 1]
+
+    def limiting_names(self):
+        names = np.array(list(self.rules.metrics) + [""])
+        return names[self.limiting]
+
+    def counts(self):
+        """
+        Per use case counts of each status, for fleet reports
+        """
+        return {
+            title: {name: int(np.count_nonzero(self.status[:, i] == code))
+                    for code, name in STATUS_NAMES.items()}
+            for i, title in enumerate(self.rules.titles)
+        }
+
+    def limiting_counts(self):
+        """
+        Per use case counts of how often each metric was the limiting one
+        among measurements that were not good
+        """
+        report = {}
+        for i, title in enumerate(self.rules.titles):
+            limiting = self.limiting[self.status[:, i] > GOOD, i]
+            report[title] = {metric: int(np.count_nonzero(limiting == j))
+                             for j, metric in enumerate(self.rules.metrics)}
+        return report
+
+
+def as_matrix(values, metrics=METRICS):
+    """
+    Accept an (N, metrics) array or a mapping of metric -> 1-D sequence and
+    return a float (N, metrics) matrix; None and missing metrics become NaN
+    """
+    if isinstance(values, dict):
+        n = len(next(iter(values.values())))
+        columns = [np.asarray([np.nan if v is None else v for v in values[m]], dtype=float)
+                   if m in values else np.full(n, np.nan) for m in metrics]
+        return np.column_stack(columns) if columns else np.empty((n, 0))
+    matrix = np.asarray(values, dtype=float)
+    if matrix.ndim != 2 or matrix.shape[1] != len(metrics):
+        raise ValueError(f"expected an (N, {len(metrics)}) array")
+    return matrix
+
+
+def score(values, rules=None, batch_size=65536):
+    """
+    Score every measurement against every use case
+    values is an (N, metrics) array or a mapping of metric -> sequence; the
+    work is done batch_size rows at a time to bound the temporary arrays
+    """
+    rules = rules or compiled_rules()
+    matrix = as_matrix(values, rules.metrics)
+    n, u = len(matrix), len(rules.titles)
+    status = np.empty((n, u), dtype=np.int8)
+    limiting = np.empty((n, u), dtype=np.int8)
+
+    good = rules.good * rules.sign
+    moderate = rules.moderate * rules.sign
+    for start in range(0, n, batch_size):
+        # (batch, 1, metrics) against (use cases, metrics) thresholds
+        v = (matrix[start:start + batch_size] * rules.sign)[:, None, :]
+        cell = np.where(v >= good, GOOD, np.where(v >= moderate, MODERATE, BAD))
+        absent = np.isnan(v)
+        # A missing optional metric is skipped, as if it weren't checked
+        missing = absent & rules.checked & ~rules.optional
+        cell = np.where(rules.checked & ~absent, cell, GOOD - 1)
+
+        worst = cell.max(axis=2)
+        any_missing = missing.any(axis=2)
+        batch_status = np.where((worst == BAD) | ~any_missing, np.maximum(worst, GOOD), UNKNOWN)
+
+        # Among the metrics with the worst status, the one furthest below its
+        # good threshold relative to that threshold is the limiting one
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shortfall = np.where(cell == worst[..., None], (good - v) / np.abs(good), -np.inf)
+        shortfall = np.nan_to_num(shortfall, nan=-np.inf)
+        batch_limiting = shortfall.argmax(axis=2)
+        batch_limiting = np.where(any_missing & (worst != BAD), missing.argmax(axis=2), batch_limiting)
+        batch_limiting = np.where(batch_status == GOOD, -1, batch_limiting)
+
+        status[start:start + batch_size] = batch_status
+        limiting[start:start + batch_size] = batch_limiting
+    return Scores(rules, status, limiting)
+
+
+# (plan, CompiledRules) for the last plan compiled
+_compiled = [None, None]
+
+
+def compiled_rules(plan=None):
+    """
+    The arrays for a rule plan (default: the current rule file), compiled
+    again only when the plan itself is reloaded
+    """
+    plan = plan or get_plan()
+    if _compiled[0] is not plan:
+        _compiled[:] = [plan, CompiledRules(plan.use_cases, inverse_metrics=plan.inverse_metrics,
+                                            optional_metrics=plan.optional_metrics)]
+    return _compiled[1]
+
+
+def load_history(store, start=None, end=None, server=None):
+    """
+    Stream the summary columns of a history range straight into arrays
+    Returns (timestamps, (N, metrics) matrix)
+    """
+    timestamps, rows = [], []
+    for run in store.query(start=start, end=end, server=server):
+        timestamps.append(run["timestamp"])
+        # Metrics a run didn't measure (e.g. no real-time stream) are NaN
+        rows.append(tuple(np.nan if run.get(m) is None else run[m] for m in METRICS))
+    matrix = np.array(rows, dtype=float).reshape(len(rows), len(METRICS))
+    return np.array(timestamps, dtype=float), matrix
@@ -0,0 +1,219 @@
+"""
+Server selection: a disk-cached server list, concurrent latency probing of the
+closest candidates and a per-location index of recent best servers
+A repeated run from the same location reuses the indexed server after one quick
+verification probe and only rediscovers when that server has degraded
+"""
+
+import json
+import math
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.request import Request, urlopen
+
+from cryos.latency import probe_latency
+
+SPEEDTEST_URL = "https://www.speedtest.net"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cryos")
+
+
+class ServerSelectionError(Exception):
+    pass
+
+
+def distance(origin, destination):
+    """
+    Great circle distance in km between two (lat, lon) pairs
+    """
+    lat1, lon1 = origin
+    lat2, lon2 = destination
+    radius = 6371
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return radius * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def fetch(url, timeout):
+    request = Request(url, headers={"User-Agent": "Cryos"})
+    with urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def parse_config(xml):
+    """
+    Client location and ignored server ids from speedtest-config.php
+    """
+    root = ET.fromstring(xml)
+    client = dict(root.find("client").attrib)
+    server_config = root.find("server-config")
+    ignore = server_config.get("ignoreids", "") if server_config is not None else ""
+    return {
+        "client": client,
+        "ignore_ids": [i for i in ignore.split(",") if i],
+    }
+
+
+def parse_servers(xml):
+    return [dict(server.attrib) for server in ET.fromstring(xml).iter("server")]
+
+
+class ServerSelector:
+    """
+    Picks the lowest latency server, caching what it can on disk under cache_dir:
+    the client config for config_ttl seconds, the server list for list_ttl
+    seconds and the best server per location for index_ttl seconds
+    """
+
+    def __init__(self, base_url=SPEEDTEST_URL, cache_dir=CACHE_DIR, config_ttl=3600.0,
+                 list_ttl=86400.0, index_ttl=86400.0, candidates=5, probes=3, deadline=3.0,
+                 timeout=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.cache_dir = cache_dir
+        self.config_ttl = config_ttl
+        self.list_ttl = list_ttl
+        self.index_ttl = index_ttl
+        self.candidates = candidates
+        self.probes = probes
+        self.deadline = deadline
+        self.timeout = timeout
+
+    def _cache_path(self, name):
+        # Separate files per base URL so a local test server never pollutes
+        # the speedtest.net cache
+        key = "".join(c if c.isalnum() else "_" for c in self.base_url)
+        return os.path.join(self.cache_dir, f"{name}-{key}.json")
+
+    def _load(self, name, ttl):
+        try:
+            with open(self._cache_path(name), encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if ttl is not None and time.time() - cached.get("fetched", 0) > ttl:
+            return None
+        return cached["data"]
+
+    def _save(self, name, data):
+        path = self._cache_path(name)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"fetched": time.time(), "data": data}, f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def config(self, refresh=False):
+        config = None if refresh else self._load("config", self.config_ttl)
+        if config is None:
+            config = parse_config(fetch(f"{self.base_url}/speedtest-config.php", self.timeout))
+            self._save("config", config)
+        return config
+
+    def servers(self, refresh=False):
+        """
+        The parsed server list, from the disk cache while it is fresh
+        """
+        servers = None if refresh else self._load("servers", self.list_ttl)
+        if servers is None:
+            servers = parse_servers(fetch(f"{self.base_url}/speedtest-servers-static.php", self.timeout))
+            if not servers:
+                raise ServerSelectionError("the server list is empty")
+            self._save("servers", servers)
+        return servers
+
+    def location_key(self, config):
+        client = config["client"]
+        # Round to ~10 km so GeoIP noise doesn't split one site into many keys
+        return "{}|{}|{:.1f},{:.1f}".format(client.get("ip", ""), client.get("isp", ""),
+                                            float(client.get("lat", 0)), float(client.get("lon", 0)))
+
+    def closest(self, config, servers):
+        origin = (float(config["client"]["lat"]), float(config["client"]["lon"]))
+        ranked = []
+        for server in servers:
+            if server.get("id") in config["ignore_ids"]:
+                continue
+            server = dict(server)
+            server["d"] = distance(origin, (float(server["lat"]), float(server["lon"])))
+            ranked.append(server)
+        ranked.sort(key=lambda server: server["d"])
+        return ranked[:self.candidates]
+
+    def probe_candidates(self, candidates):
+        """
+        Probe every candidate at once and return (latency_ms, server) pairs,
+        sorted by latency; candidates that haven't answered by the deadline or
+        lost every probe are dropped
+        """
+        if not candidates:
+            raise ServerSelectionError("no candidate servers to probe (all ignored, or candidates is 0)")
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        # Filled one by one, so a submit() that raises still leaves the probes
+        # already submitted for the cleanup to cancel
+        futures = {}
+        try:
+            for server in candidates:
+                futures[executor.submit(probe_latency, server, self.probes, 0.0, self.timeout)] = server
+            done, _ = wait(futures, timeout=self.deadline)
+        finally:
+            # Don't wait for stragglers; their threads finish in the background.
+            # Probes not yet started are cancelled by hand, as shutdown's
+            # cancel_futures needs Python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+        ranked = []
+        for future in done:
+            if future.exception() is None and future.result()["mean"] is not None:
+                ranked.append((future.result()["mean"], futures[future]))
+        ranked.sort(key=lambda pair: pair[0])
+        return ranked
+
+    def verify(self, entry):
+        """
+        Re-probe an indexed server; return its latency if it still answers
+        close to the recorded one, None if it has degraded
+        """
+        result = probe_latency(entry["server"], num_probes=self.probes, timeout=self.timeout)
+        if result["mean"] is None or result["loss"] > 0:
+            return None
+        if result["mean"] > max(entry["latency"] * 1.5, entry["latency"] + 20.0):
+            return None
+        return result["mean"]
+
+    def best(self, refresh=False):
+        """
+        Return the best server as a speedtest-cli style entry with its
+        distance ("d") and latency in ms
+        """
+        config = self.config(refresh=refresh)
+        key = self.location_key(config)
+        index = self._load("best", None) or {}
+        entry = index.get(key)
+
+        if not refresh and entry and time.time() - entry["updated"] <= self.index_ttl:
+            latency = self.verify(entry)
+            if latency is not None:
+                return dict(entry["server"], latency=latency, cached=True)
+
+        candidates = self.closest(config, self.servers(refresh=refresh))
+        ranked = self.probe_candidates(candidates)
+        if not ranked:
+            raise ServerSelectionError("Unable to connect to servers to test latency.")
+        latency, server = ranked[0]
+
+        index[key] = {"server": server, "latency": latency, "updated": time.time()}
+        self._save("best", index)
+        return dict(server, latency=latency, cached=False)
+
+
+def select_server(base_url=SPEEDTEST_URL, refresh=False, **options):
+    """
+    Shortcut for ServerSelector(base_url, **options).best(refresh)
+    """
+    return ServerSelector(base_url, **options).best(refresh=refresh)
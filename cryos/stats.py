@@ -0,0 +1,145 @@
+"""
+Streaming latency statistics in constant memory: a DDSketch-style quantile
+sketch plus running loss, mean and RFC 3550 jitter, so probe runs of any length
+report p50/p90/p99 without keeping every sample
+"""
+
+import math
+
+
+class QuantileSketch:
+    """
+    Relative-error quantile sketch (DDSketch)
+    Values are counted in logarithmic buckets, so any quantile is returned
+    within relative_accuracy of the true value; memory is bounded by
+    max_buckets, after which the lowest buckets are collapsed (the tail
+    percentiles stay exact to the accuracy)
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        # Values too small for a log bucket (0 ms RTTs on loopback)
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 1e-9:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            low, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(low)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("can only merge sketches with the same accuracy")
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.buckets) > self.max_buckets:
+            low, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(low)
+
+    def quantile(self, q):
+        """
+        Value at quantile q (0-1), or None for an empty sketch
+        Nearest rank: the ceil(q * count)-th smallest value, so p99 over a
+        handful of probes is the largest one
+        """
+        if self.count == 0:
+            return None
+        # The epsilon keeps float noise (0.07 * 100) from bumping the rank
+        rank = max(1, math.ceil(q * self.count - 1e-9))
+        seen = self.zero_count
+        if rank <= seen:
+            return max(self.min, 0.0)
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                # Midpoint of the bucket in relative terms, clamped to what was seen
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class LatencyStats:
+    """
+    Running summary of a probe run; add() takes an RTT in ms or None for a
+    lost probe
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.sent = 0
+        self.total = 0.0
+        self.previous = None
+        self.jitter = 0.0
+        self.differences = 0
+
+    @classmethod
+    def from_samples(cls, samples):
+        stats = cls()
+        for rtt in samples:
+            stats.add(rtt)
+        return stats
+
+    def add(self, rtt):
+        self.sent += 1
+        if rtt is None:
+            return
+        self.sketch.add(rtt)
+        self.total += rtt
+        # RFC 3550 interarrival jitter: J += (|D| - J) / 16 over consecutive samples.
+        # Starting from J = 0 that gain leaves a short run far below the real
+        # jitter, so the first 16 differences are averaged instead
+        if self.previous is not None:
+            self.differences += 1
+            self.jitter += (abs(rtt - self.previous) - self.jitter) / min(self.differences, 16)
+        self.previous = rtt
+
+    @property
+    def received(self):
+        return self.sketch.count
+
+    @property
+    def loss(self):
+        return (self.sent - self.received) / self.sent if self.sent else 0.0
+
+    @property
+    def mean(self):
+        return self.total / self.received if self.received else None
+
+    def percentile(self, p):
+        return self.sketch.quantile(p / 100.0)
+
+    def summary(self):
+        """
+        JSON serializable summary, times in ms
+        """
+        return {
+            "count": self.sent,
+            "loss": self.loss,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "mean": self.mean,
+            "jitter": self.jitter,
+            "min": self.sketch.min if self.received else None,
+            "max": self.sketch.max if self.received else None,
+        }
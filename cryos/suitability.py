@@ -0,0 +1,92 @@
+"""
+Network suitability analysis: per metric status, use case verdicts and
+personalized improvement suggestions, driven by the rule file in cryos.rules
+A result is any mapping with "download", "upload", "ping" and "jitter" values
+"""
+
+from cryos.rules import DEFAULT_PATH, get_plan
+
+# Latency metrics are inverse metrics, lower values are better
+INVERSE_METRICS = ("ping", "jitter", "bufferbloat", "ping_p50", "ping_p90", "ping_p99", "packet_loss", "loss_burst")
+
+# Not in every result (older history, tests without loaded latency or a
+# real-time stream); skipped when absent
+OPTIONAL_METRICS = ("bufferbloat", "ping_p50", "ping_p90", "ping_p99", "packet_loss", "loss_burst", "mos")
+
+# The bundled use case table; the table in use comes from the rule file
+# (cryos/rules.json or $CRYOS_RULES), see cryos.rules
+USE_CASES = get_plan(DEFAULT_PATH).use_cases
+
+
+def get_status(value, thresholds, inverse=False):
+    """
+    Get status based on thresholds
+    inverse=True means lower values are better (for ping and jitter)
+    """
+    if inverse:
+        # For inverse metrics (ping, jitter) - lower is better
+        if value <= thresholds[0]:
+            return "good"
+        elif value <= thresholds[1]:
+            return "moderate"
+        else:
+            return "bad"
+    else:
+        # For regular metrics (download, upload) - higher is better
+        if value >= thresholds[0]:
+            return "good"
+        elif value >= thresholds[1]:
+            return "moderate"
+        else:
+            return "bad"
+
+
+def evaluate_use_case(result, checks):
+    """
+    Combine the status of every metric a use case checks
+    Any bad metric makes the use case bad, any moderate one makes it moderate;
+    a missing metric (e.g. no throughput in a latency-only probe) makes it
+    unknown unless another metric is already bad; a missing optional metric
+    is just skipped
+    """
+    status = "good"
+    missing = False
+    for cat, thresholds in checks.items():
+        if result.get(cat) is None:
+            missing = missing or cat not in OPTIONAL_METRICS
+            continue
+        cat_status = get_status(result[cat], thresholds, cat in INVERSE_METRICS)
+        if cat_status == "bad":
+            return "bad"
+        elif cat_status == "moderate":
+            status = "moderate"
+    return "unknown" if missing else status
+
+
+def analyze(result, use_cases=None, plan=None):
+    """
+    Evaluate a result against every use case
+    Returns one dict per use case with its title, icon, status and message
+    Without an explicit use_cases table the current rule file's compiled plan is used
+    """
+    if use_cases is None:
+        return (plan or get_plan()).analyze(result)
+    messages = {"good": "good_msg", "moderate": "mod_msg", "bad": "bad_msg"}
+    analysis = []
+    for case in use_cases:
+        status = evaluate_use_case(result, case["checks"])
+        analysis.append({
+            "title": case["title"],
+            "icon": case["icon"],
+            "status": status,
+            "message": case[messages[status]] if status in messages else "",
+        })
+    return analysis
+
+
+def build_suggestions(result, plan=None):
+    """
+    Build the personalized improvement suggestions for a result
+    Metrics the result doesn't have (e.g. throughput in a latency probe) are skipped
+    """
+    return (plan or get_plan()).suggestions(result)
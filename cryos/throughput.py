@@ -0,0 +1,339 @@
+"""
+Multi-stream download/upload engine against a selected speedtest server
+Each stream keeps one HTTP connection alive and moves fixed size chunks until a
+wall-clock cap is reached; the first seconds are discarded as TCP slow-start
+warm-up so the reported speed is the steady-state rate
+With a tolerance set, a transfer also ends as soon as its rate has settled, so
+stable links are measured in a fraction of the cap
+"""
+
+import math
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlparse
+
+# Sizes of the random{size}x{size}.jpg images speedtest servers provide
+DOWNLOAD_SIZES = (350, 500, 750, 1000, 1500, 2000, 2500, 3000, 3500, 4000)
+
+try:
+    import fcntl
+    import termios
+    # Linux: bytes in a socket's send queue that the peer has not acknowledged
+    SIOCOUTQ = termios.TIOCOUTQ
+except (ImportError, AttributeError):
+    fcntl = None
+
+
+# Two-sided 95% Student t quantiles for 1 to 10 degrees of freedom
+T_975 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228)
+
+
+def do_nothing(*args, **kwargs):
+    pass
+
+
+class SampleRing:
+    """
+    Bounded ring buffer of per-interval throughput samples, written by the
+    sampler and read incrementally by a live display in another thread
+    Each sample is (direction, monotonic time, bytes in the interval, interval
+    seconds). Only the newest capacity samples are kept, so memory stays
+    constant however long a test runs
+    """
+
+    def __init__(self, capacity=1200):
+        self.capacity = capacity
+        self.items = [None] * capacity
+        # Samples ever appended; the next one goes to items[total % capacity]
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def append(self, sample):
+        with self.lock:
+            self.items[self.total % self.capacity] = sample
+            self.total += 1
+
+    def since(self, position):
+        """
+        Return (samples appended after position, new position); samples that
+        were overwritten before being read are skipped
+        """
+        with self.lock:
+            start = max(position, self.total - self.capacity)
+            return [self.items[i % self.capacity] for i in range(start, self.total)], self.total
+
+
+class ConvergenceMonitor:
+    """
+    Decides when a transfer's steady-state rate has settled
+    Post warm-up intervals are grouped into batches of batch seconds. The
+    steady-state rate gets a 95% confidence interval from the spread of the
+    batch means, and the rolling rate is the mean of the last window seconds
+    of batches. The rate has converged once the interval's half-width and the
+    gap between the rolling and steady-state rates (a trend that is still
+    going) are both within tolerance of the steady-state rate
+    """
+
+    def __init__(self, tolerance=0.05, batch=1.0, window=3.0):
+        if tolerance <= 0:
+            raise ValueError("tolerance must be positive")
+        self.tolerance = tolerance
+        self.batch = batch
+        self.window = max(2, round(window / batch))
+        # One rate per batch; the duration cap bounds how many there are
+        self.rates = []
+        self.pending_bytes, self.pending_time = 0, 0.0
+
+    def add(self, moved, seconds):
+        self.pending_bytes += moved
+        self.pending_time += seconds
+        if self.pending_time >= self.batch:
+            self.rates.append(self.pending_bytes / self.pending_time)
+            self.pending_bytes, self.pending_time = 0, 0.0
+
+    def estimate(self):
+        """
+        (rolling rate, confidence half-width of the mean rate) in bytes per
+        second, or None until a full window of batches is in
+        """
+        n = len(self.rates)
+        if n < self.window:
+            return None
+        mean = sum(self.rates) / n
+        deviation = math.sqrt(sum((rate - mean) ** 2 for rate in self.rates) / (n - 1))
+        t = T_975[n - 2] if n - 1 <= len(T_975) else 1.96
+        return sum(self.rates[-self.window:]) / self.window, t * deviation / math.sqrt(n)
+
+    def converged(self, steady_rate):
+        estimate = self.estimate()
+        if estimate is None or steady_rate <= 0:
+            return False
+        rolling, half_width = estimate
+        limit = self.tolerance * steady_rate
+        return half_width <= limit and abs(rolling - steady_rate) <= limit
+
+
+def _connect(parts, timeout):
+    connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+    return connection_class(parts.netloc, timeout=timeout)
+
+
+def _unacked_bytes(sock):
+    """
+    Bytes handed to the kernel that the peer has not acknowledged yet, or 0
+    where the platform can't tell
+    Counting upload bytes as they are sent would otherwise credit whatever
+    sits in the socket buffers, which can be seconds' worth on a slow link
+    """
+    if fcntl is None or sock is None:
+        return 0
+    try:
+        return int.from_bytes(fcntl.ioctl(sock.fileno(), SIOCOUTQ, b"\0\0\0\0"),
+                              sys.byteorder, signed=True)
+    except (OSError, ValueError):
+        # ValueError: the socket was closed under us
+        return 0
+
+
+def _download_stream(index, parts, path, counters, requests, stop, chunk_size, sockets, timeout):
+    """
+    Fetch the download image over and over on one kept-alive connection,
+    adding every chunk read to counters[index], counting requests in
+    requests[index] and keeping the live socket in sockets[index]
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    connection = None
+    while not stop.is_set():
+        try:
+            if connection is None:
+                connection = _connect(parts, timeout)
+                connection.connect()
+                sockets[index] = connection.sock
+            connection.request("GET", f"{path}?x={time.time()}.{index}.{requests[index]}",
+                               headers={'User-Agent': 'Cryos', 'Connection': 'keep-alive'})
+            requests[index] += 1
+            response = connection.getresponse()
+            if response.status != 200:
+                raise HTTPException(f"download returned HTTP {response.status}")
+            while not stop.is_set():
+                read = response.readinto(buffer)
+                if not read:
+                    break
+                counters[index] += read
+            if stop.is_set():
+                break
+        except (OSError, HTTPException):
+            if connection is not None:
+                connection.close()
+                connection = None
+            # Back off briefly so a dead server does not turn into a busy loop
+            stop.wait(0.1)
+    if connection is not None:
+        connection.close()
+
+
+def _upload_stream(index, parts, path, counters, requests, stop, chunk_size, body, sockets, timeout):
+    """
+    POST the body over and over on one kept-alive connection, adding every
+    chunk sent to counters[index] and keeping the live socket in sockets[index]
+    so the sampler can subtract what the server has not acknowledged yet
+    """
+    upload_size = len(body)
+    connection = None
+    while not stop.is_set():
+        try:
+            if connection is None:
+                connection = _connect(parts, timeout)
+                connection.connect()
+                sockets[index] = connection.sock
+            connection.putrequest("POST", path)
+            connection.putheader('User-Agent', 'Cryos')
+            connection.putheader('Content-Type', 'application/x-www-form-urlencoded')
+            connection.putheader('Content-Length', str(upload_size))
+            connection.endheaders()
+            requests[index] += 1
+            for offset in range(0, upload_size, chunk_size):
+                if stop.is_set():
+                    break
+                chunk = body[offset:offset + chunk_size]
+                connection.send(chunk)
+                counters[index] += len(chunk)
+            if stop.is_set():
+                # The request body is incomplete, so the connection can't be reused
+                break
+            response = connection.getresponse()
+            response.read()
+        except (OSError, HTTPException):
+            if connection is not None:
+                connection.close()
+                connection = None
+            stop.wait(0.1)
+    if connection is not None:
+        connection.close()
+
+
+def measure_throughput(server, direction, streams=4, duration=10.0, warmup=2.0,
+                       chunk_size=65536, download_size=4000, upload_size=4_194_304,
+                       timeout=10.0, interval=0.1, on_progress=do_nothing, samples=None, max_bytes=None,
+                       tolerance=None, min_duration=0.0):
+    """
+    Measure download or upload throughput with several concurrent connections
+    duration is the wall-clock cap in seconds and warmup the leading part of it
+    that is ignored when computing the steady-state speed
+    tolerance (relative, e.g. 0.05) ends the transfer once a ConvergenceMonitor
+    says the steady-state rate has settled, but never before min_duration
+    (or the cap, if shorter)
+    on_progress(fraction, message) is called every interval seconds, and the
+    bytes moved in each interval are appended to samples (a SampleRing) if given
+    max_bytes ends the transfer early once that many bytes have been moved; the
+    warm-up then also ends once half of them have, so the other half is steady
+    state even when the cap can't cover a full warm-up
+    Returns a dict with the steady-state and raw Mbps, bytes moved, timings and
+    the per-interval [elapsed, bytes] pairs
+    """
+    if direction not in ("download", "upload"):
+        raise ValueError(f"unknown direction: {direction}")
+    if warmup >= duration:
+        raise ValueError("warmup must be shorter than duration")
+    if download_size not in DOWNLOAD_SIZES:
+        raise ValueError(f"download_size must be one of {DOWNLOAD_SIZES}")
+    # A short cap wins over the minimum length
+    min_duration = min(min_duration, duration)
+    convergence = ConvergenceMonitor(tolerance) if tolerance else None
+
+    # Each stream only ever writes its own slot, so no lock is needed
+    counters = [0] * streams
+    requests = [0] * streams
+    sockets = [None] * streams
+    parts = urlparse(server['url'])
+    if direction == "download":
+        path = f"{os.path.dirname(parts.path)}/random{download_size}x{download_size}.jpg"
+        target, extra = _download_stream, (sockets,)
+    else:
+        path = parts.path
+        # One read-only body shared by every stream
+        target, extra = _upload_stream, (memoryview(b"content1=" + b"0" * (upload_size - 9)), sockets)
+
+    def bytes_moved():
+        if direction == "download":
+            return sum(counters)
+        return sum(counters) - sum(_unacked_bytes(sock) for sock in sockets)
+
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=target, args=(i, parts, path, counters, requests, stop, chunk_size) + extra + (timeout,),
+                         daemon=True)
+        for i in range(streams)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    warm_bytes, warm_time = None, None
+    elapsed, moved = 0.0, 0
+    intervals = []
+    converged = False
+    while elapsed < duration:
+        stop.wait(min(interval, duration - elapsed))
+        previous_elapsed, previous_moved = elapsed, moved
+        elapsed = time.perf_counter() - started
+        moved = bytes_moved()
+        intervals.append([round(elapsed, 4), moved - previous_moved])
+        if samples is not None:
+            samples.append((direction, time.monotonic(), moved - previous_moved, elapsed - previous_elapsed))
+        if warm_bytes is None and (elapsed >= warmup or (max_bytes is not None and moved >= max_bytes / 2)):
+            warm_bytes, warm_time = moved, elapsed
+        elif convergence is not None and warm_bytes is not None:
+            convergence.add(moved - previous_moved, elapsed - previous_elapsed)
+            steady_rate = (moved - warm_bytes) / (elapsed - warm_time)
+            converged = elapsed >= min_duration and convergence.converged(steady_rate)
+        on_progress(min(elapsed / duration, 1.0),
+                    f"Testing {direction} speed... {moved * 8 / elapsed / 1_000_000:.2f} Mbps")
+        if converged or (max_bytes is not None and moved >= max_bytes):
+            break
+
+    stop.set()
+    total = moved
+    # A stream blocked in send() would otherwise keep pushing its request body
+    # after the cap and eat into whatever is measured next. Shutting down wakes
+    # it, and with a zero linger its close() resets the connection instead of
+    # flushing the send buffer
+    for sock in sockets:
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    deadline = time.perf_counter() + 1.0
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.perf_counter()))
+
+    raw_mbps = total * 8 / elapsed / 1_000_000 if elapsed > 0 else 0.0
+    if warm_time is None or elapsed - warm_time < interval:
+        # The byte cap was hit during or right at the end of warm-up, leaving
+        # no steady-state interval; report the raw rate
+        mbps = raw_mbps
+        warm_time = warm_time or 0.0
+    else:
+        mbps = (total - warm_bytes) * 8 / (elapsed - warm_time) / 1_000_000
+    estimate = convergence.estimate() if convergence is not None else None
+    return {
+        "mbps": mbps,
+        "raw_mbps": raw_mbps,
+        "bytes": total,
+        "elapsed": elapsed,
+        "warmup": warm_time,
+        "streams": streams,
+        "requests": sum(requests),
+        "converged": converged,
+        # 95% confidence half-width of the steady-state rate when adaptive
+        "ci_mbps": estimate[1] * 8 / 1_000_000 if estimate is not None else None,
+        "intervals": intervals,
+    }
@@ -1,12 +1,25 @@
 import streamlit as st
-import speedtest
-import time
-import numpy as np
-import plotly.graph_objects as go
 from streamlit_lottie import st_lottie
 import json
 import requests
-import statistics
+import threading
+import time
+import functools
+import os
+import hashlib
+import sqlite3
+from datetime import datetime, time as dt_time, timedelta, timezone
+
+from cryos.runner import run_speed_test, server_from_url
+from cryos.rules import METRICS, get_plan
+from cryos.realtime import parse_target
+from cryos.suitability import analyze, build_suggestions
+from cryos.render import create_speedometer, create_use_case_card
+from cryos.history import HistoryStore
+from cryos.jobs import DONE, SpeedTestExecutor
+from cryos.profiling import NULL_TRACER, Tracer, chrome_trace, enabled as profiling_enabled
+from cryos.fleet import FleetStore, default_path as fleet_db_path
+from cryos.servers import ServerSelector
 
 # Set page configuration
 st.set_page_config(
@@ -123,124 +136,179 @@ def local_css():
 local_css()
 
 # Helper functions for animated elements
-def load_lottieurl(url):
-    r = requests.get(url)
-    if r.status_code != 200:
-        return None
-    return r.json()
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+LOTTIE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cryos", "lottie")
+
+def fetch_lottie_to_cache(url, cache_path, timeout=3):
+    """
+    Download a Lottie animation into the on-disk cache, ignoring any failure
+    """
+    try:
+        r = requests.get(url, timeout=timeout)
+        if r.status_code != 200:
+            return
+        animation = r.json()
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temporary file first so a reader never sees a partial file
+        with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(animation, f)
+        os.replace(cache_path + ".tmp", cache_path)
+    except (requests.RequestException, ValueError, OSError):
+        pass
+
+@st.cache_resource(show_spinner=False)
+def load_lottieurl(url, fallback="loading_animation.json"):
+    """
+    Load a Lottie animation once per process
+    Uses the on-disk cache when present, otherwise returns the animation bundled
+    in assets/ and fills the cache from the URL in the background, so no page
+    load ever waits on the CDN
+    """
+    cache_path = os.path.join(LOTTIE_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest() + ".json")
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    threading.Thread(target=fetch_lottie_to_cache, args=(url, cache_path), daemon=True).start()
+    with open(os.path.join(ASSET_DIR, fallback), encoding="utf-8") as f:
+        return json.load(f)
 
 # Load animations
 loading_animation = load_lottieurl("https://assets10.lottiefiles.com/packages/lf20_p8bfn5to.json")
 
-# Create animated speedometer
-def create_speedometer(value, max_value, title, units, color_scale, is_inverse=False):
+@st.cache_resource(show_spinner=False)
+def get_history_store():
     """
-    Create a speedometer gauge with proper color scaling
-    is_inverse=True means lower values are better (for ping and jitter)
+    One history store per process, shared by every session
     """
-    # For inverse metrics (ping, jitter), reverse the color scale
-    if is_inverse:
-        color_scale = color_scale[::-1]
-    
-    fig = go.Figure(go.Indicator(
-        mode="gauge+number+delta",
-        value=value,
-        domain={'x': [0, 1], 'y': [0, 1]},
-        title={'text': title, 'font': {'size': 24, 'color': '#00FFFF'}},
-        delta={'reference': max_value/2 if not is_inverse else max_value/2, 
-               'increasing': {'color': "#00FFFF" if not is_inverse else "#FF5555"},
-               'decreasing': {'color': "#00FFFF" if is_inverse else "#FF5555"}},
-        gauge={
-            'axis': {'range': [None, max_value], 'tickwidth': 1, 'tickcolor': "white"},
-            'bar': {'color': "#00FFFF"},
-            'bgcolor': "rgba(0,0,0,0)",
-            'borderwidth': 2,
-            'bordercolor': "gray",
-            'steps': [
-                {'range': [0, max_value/3], 'color': color_scale[0]},
-                {'range': [max_value/3, 2*max_value/3], 'color': color_scale[1]},
-                {'range': [2*max_value/3, max_value], 'color': color_scale[2]}
-            ],
-            'threshold': {
-                'line': {'color': "white", 'width': 4},
-                'thickness': 0.75,
-                'value': value
-            }
-        }
-    ))
-    
-    fig.update_layout(
-        height=300,
-        margin=dict(l=20, r=20, t=50, b=20),
-        paper_bgcolor="rgba(0,0,0,0)",
-        font={'color': "white", 'family': "Arial"},
-        annotations=[
-            dict(
-                text=f"{units}",
-                x=0.5,
-                y=0.25,
-                font=dict(size=16, color="#00FFFF"),
-                showarrow=False,
-                xanchor="center"
-            )
-        ]
-    )
-    
-    # Add animation effects
-    fig.update_layout(
-        updatemenus=[
-            dict(
-                type="buttons",
-                showactive=False,
-                buttons=[
-                    dict(
-                        label="Animate",
-                        method="animate",
-                        args=[None, {"frame": {"duration": 500, "redraw": True}, "fromcurrent": True}]
-                    )
-                ],
-                visible=False
-            )
-        ]
-    )
-    
-    return fig
+    return HistoryStore()
+
+@st.cache_resource(show_spinner=False)
+def open_fleet_store(path):
+    return FleetStore(path)
+
+def get_fleet_store():
+    """
+    The fleet store fed by `cryos ingest`, if this instance has one
+    Only an opened store is cached, so a database that `cryos ingest` creates
+    after the app started still shows up
+    """
+    path = fleet_db_path()
+    return open_fleet_store(path) if os.path.exists(path) else None
+
+# Point the app at a fixed server (e.g. `cryos serve`) instead of discovering one,
+# or discover from another speedtest deployment
+SERVER_URL = os.environ.get("CRYOS_SERVER_URL")
+SPEEDTEST_URL = os.environ.get("CRYOS_SPEEDTEST_URL", "https://www.speedtest.net")
+
+# A UDP echo server (e.g. `cryos serve`, HOST:PORT) for the real-time stream
+# behind the packet loss and MOS verdicts; speedtest servers don't echo UDP
+REALTIME_TARGET = os.environ.get("CRYOS_REALTIME_TARGET")
+REALTIME_DURATION = float(os.environ.get("CRYOS_REALTIME_DURATION", 10))
+
+# CRYOS_PROFILE=1 traces every test and page run and shows a Run timings panel
+PROFILE = profiling_enabled()
 
-# Function to measure jitter properly
-def measure_jitter(num_pings=10):
+def run_and_record(on_progress, samples, store, num_pings=5):
     """
-    Measure network jitter by running multiple pings and calculating the standard deviation
-    This is a more accurate way to measure jitter than the original random approach
+    One test as run by the background executor: measure, analyze and append
+    to the history once, however many sessions are watching it
     """
+    tracer = Tracer() if PROFILE else NULL_TRACER
+    run_span = tracer.span("run").begin()
+    server = server_from_url(SERVER_URL) if SERVER_URL else None
+    realtime = None
+    if REALTIME_TARGET:
+        host, port = parse_target(REALTIME_TARGET)
+        realtime = {"host": host, "port": port, "duration": REALTIME_DURATION}
+    result = run_speed_test(num_pings=num_pings, on_progress=on_progress, server=server,
+                            selector=ServerSelector(SPEEDTEST_URL), samples=samples,
+                            tolerance=0.05, min_duration=4.0, tracer=tracer, realtime=realtime)
+    with tracer.span("analysis"):
+        result["analysis"] = analyze(result)
+    run_span.finish()
+    if tracer.active:
+        result["timings"] = tracer.to_dict()
     try:
-        # Initialize lists to store ping times
-        ping_times = []
-        
-        # Use speedtest's get_best_server and ping methods multiple times
-        test = speedtest.Speedtest()
-        server = test.get_best_server()
-        
-        # Get multiple ping measurements
-        for _ in range(num_pings):
-            test = speedtest.Speedtest()
-            test.get_best_server()
-            ping_times.append(test.results.ping)
-            time.sleep(0.2)  # Short delay between pings
-        
-        # Calculate jitter as the standard deviation of ping times
-        if len(ping_times) > 1:
-            jitter = statistics.stdev(ping_times)
-        else:
-            jitter = 0.0
-            
-        # Get the average ping for reporting
-        avg_ping = statistics.mean(ping_times)
-        
-        return avg_ping, jitter
-    except Exception as e:
-        # If there's an error, return reasonable defaults
-        st.warning(f"Error measuring jitter: {e}")
-        return 50.0, 5.0
+        store.append(result)
+    except sqlite3.Error as e:
+        result["warnings"].append(f"Could not save the result to the history: {e}")
+    return result
+
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    """
+    One test executor per process: tests run off the script thread, one at a
+    time, and a click while a test is running joins it instead of starting
+    another; reruns only poll the job. A click within $CRYOS_RESULT_MAX_AGE
+    seconds of the last test gets its cached result
+    """
+    return SpeedTestExecutor(functools.partial(run_and_record, store=get_history_store()))
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def use_case_grid(measured, rules_revision):
+    """
+    The use case cards for one set of measurements, (metric, value) pairs, as
+    a single HTML grid
+    Cached on the values and the rule plan, so reruns that change neither skip
+    the analysis and the markup
+    """
+    use_cases = analyze(dict(measured))
+    cards = "".join(create_use_case_card(case["title"], case["icon"], case["status"], case["message"])
+                    for case in use_cases)
+    return f'<div style="display: grid; grid-template-columns: repeat(3, 1fr); gap: 1rem;">{cards}</div>'
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def suggestion_grid(measured, rules_revision):
+    """
+    The improvement suggestions as a two column HTML grid, cached like use_case_grid
+    """
+    suggestions = build_suggestions(dict(measured))
+    cards = "".join(f"""
+        <div style="background: rgba(0, 60, 120, 0.3); border-radius: 10px; padding: 15px; border-left: 4px solid #00FFFF;">
+            <h4 style="color: #00FFFF; margin-top: 0;">{suggestion['icon']} {suggestion['title']}</h4>
+            <p style="margin-bottom: 0;">{suggestion['content']}</p>
+        </div>""" for suggestion in suggestions)
+    return f'<div style="display: grid; grid-template-columns: repeat(2, 1fr); gap: 15px;">{cards}</div>'
+
+def format_age(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f} s"
+    return f"{seconds / 60:.0f} min"
+
+# Share of the progress bar covered by each phase
+PHASE_RANGES = {"server": (0, 15), "latency": (15, 30), "realtime": (30, 45), "download": (45, 72),
+                "upload": (72, 99)}
+
+# Seconds between polls of a running job
+POLL_INTERVAL = 0.5
+
+def show_job_progress(job):
+    """
+    Progress bar, status and live throughput chart for a running job
+    The chart is redrawn from the job's sample ring on every poll; the ring is
+    bounded, so each redraw costs the same however long the test runs
+    """
+    progress = job.progress
+    low, high = PHASE_RANGES.get(progress["phase"], (0, 99))
+    st.progress(int(low + (high - low) * progress["fraction"]))
+    st.text(progress["message"])
+    samples, _ = job.samples.since(0)
+    if samples:
+        first_sample = samples[0][1]
+        rows = {"seconds": [], "download": [], "upload": []}
+        for direction, at, moved, seconds in samples:
+            mbps = moved * 8 / seconds / 1_000_000 if seconds > 0 else 0.0
+            rows["seconds"].append(round(at - first_sample, 2))
+            rows["download"].append(mbps if direction == "download" else float("nan"))
+            rows["upload"].append(mbps if direction == "upload" else float("nan"))
+        st.line_chart(rows, x="seconds", y=["download", "upload"], color=["#00FFFF", "#FF55FF"])
+
+# Spans for this script run, shown in the Run timings panel
+page_tracer = Tracer() if PROFILE else NULL_TRACER
+rerun_span = page_tracer.span("rerun").begin()
 
 # Cryos Header with enhanced design
 st.markdown("""
@@ -262,6 +330,7 @@ st.markdown("""
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     start_test = st.button("Run Speed Test", use_container_width=True)
+    force_fresh = st.checkbox("Force fresh", help="Run a new test even if a recent result is cached")
 
 # Initialize session state for animated testing
 if 'test_progress' not in st.session_state:
@@ -276,6 +345,8 @@ if 'ping' not in st.session_state:
     st.session_state.ping = 0
 if 'jitter' not in st.session_state:
     st.session_state.jitter = 0
+if 'bufferbloat' not in st.session_state:
+    st.session_state.bufferbloat = None
 
 # Speedometer container
 speedometer_container = st.container()
@@ -289,76 +360,50 @@ analysis_container = st.container()
 # Suggestions container
 suggestions_container = st.container()
 
+executor = get_executor()
 if start_test:
-    # Reset state
-    st.session_state.test_complete = False
+    job = executor.submit(SERVER_URL or SPEEDTEST_URL, fresh=force_fresh, num_pings=5)
+    st.session_state.job_id = job.id
     st.session_state.test_progress = 0
-    
-    # Show loading animation
+    if job.active:
+        st.session_state.test_complete = False
+    else:
+        # A recent result was served from the cache
+        st.session_state.applied_job = None
+        with col2:
+            st.info(f"Showing the result of a test that finished {format_age(job.age)} ago. "
+                    "Tick Force fresh to run a new one.")
+else:
+    job = executor.get(st.session_state.job_id) if "job_id" in st.session_state else None
+if job is None or not job.active:
+    # A refreshed page, or another visitor's test, attaches to the running job
+    running = executor.current()
+    if running is not None:
+        job = running
+        st.session_state.job_id = job.id
+
+polling = job is not None and job.active
+if polling:
     with speedometer_container:
         st_lottie(loading_animation, height=200, key="loading")
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        # Simulate the testing process
-        status_text.text("Initializing speed test...")
-        time.sleep(1)
-        
-        try:
-            # Connecting to servers
-            status_text.text("Finding optimal server...")
-            progress_bar.progress(10)
-            test = speedtest.Speedtest()
-            test.get_best_server()
-            time.sleep(1)
-            
-            # First measure ping and jitter
-            status_text.text("Measuring ping and jitter...")
-            progress_bar.progress(30)
-            
-            # Use proper jitter measurement instead of random values
-            ping, jitter = measure_jitter(num_pings=5)
-            st.session_state.ping = ping
-            st.session_state.jitter = jitter
-            status_text.text(f"Ping: {ping:.2f} ms, Jitter: {jitter:.2f} ms")
-            time.sleep(1)
-            
-            # Download test
-            status_text.text("Testing download speed...")
-            progress_bar.progress(50)
-            
-            # Simulate real-time updating
-            for i in range(50, 70):
-                time.sleep(0.05)
-                progress_bar.progress(i)
-                
-            download = test.download() / 1_000_000
-            st.session_state.download = download
-            status_text.text(f"Download speed: {download:.2f} Mbps")
-            time.sleep(1)
-            
-            # Upload test
-            status_text.text("Testing upload speed...")
-            progress_bar.progress(70)
-            
-            # Simulate real-time updating
-            for i in range(70, 95):
-                time.sleep(0.05)
-                progress_bar.progress(i)
-                
-            upload = test.upload() / 1_000_000
-            st.session_state.upload = upload
-            status_text.text(f"Upload speed: {upload:.2f} Mbps")
-            time.sleep(1)
-            
-            # Complete
-            progress_bar.progress(100)
-            status_text.text("Test completed successfully!")
+        show_job_progress(job)
+elif job is not None and st.session_state.get("applied_job") != job.id:
+    # Copy a finished job's result into this session once
+    st.session_state.applied_job = job.id
+    with speedometer_container:
+        if job.state == DONE:
+            result = job.result
+            for warning in result["warnings"]:
+                st.warning(warning)
+            st.session_state.result = result
+            st.session_state.ping = result["ping"]
+            st.session_state.jitter = result["jitter"]
+            st.session_state.download = result["download"]
+            st.session_state.upload = result["upload"]
+            st.session_state.bufferbloat = result["bufferbloat"]
             st.session_state.test_complete = True
-            
-        except Exception as e:
-            status_text.text(f"An error occurred: {e}")
-            st.error(f"Speed test failed: {e}")
+        else:
+            st.error(f"Speed test failed: {job.error}")
 
 # Display results once test is complete
 if st.session_state.test_complete:
@@ -366,6 +411,7 @@ if st.session_state.test_complete:
         st.empty()  # Clear the loading animation
         
         # Create speedometer display
+        gauges_span = page_tracer.span("gauges").begin()
         st.markdown("## 📊 Test Results")
         
         col1, col2 = st.columns(2)
@@ -413,274 +459,152 @@ if st.session_state.test_complete:
                 is_inverse=True
             )
             st.plotly_chart(jitter_fig, use_container_width=True)
+        gauges_span.finish()
+        
+        # Latency while the link is busy, measured alongside the transfers
+        loaded = st.session_state.result.get("loaded_latency") if "result" in st.session_state else None
+        if loaded and loaded["grade"]:
+            st.markdown(f"### 🚦 Latency Under Load — Bufferbloat grade {loaded['grade']}")
+            idle_col, down_col, up_col = st.columns(3)
+            idle_col.metric("Idle (median)", f"{loaded['idle']['p50']:.1f} ms",
+                            help=f"p90 {loaded['idle']['p90']:.1f} ms")
+            for col, phase in ((down_col, "download"), (up_col, "upload")):
+                summary = loaded.get(phase)
+                if summary and summary["p50"] is not None:
+                    col.metric(f"{phase.capitalize()}ing (median)", f"{summary['p50']:.1f} ms",
+                               delta=f"{summary['p50'] - loaded['idle']['p50']:+.1f} ms", delta_color="inverse",
+                               help=f"p90 {summary['p90']:.1f} ms, p99 {summary['p99']:.1f} ms")
+
+        # Paced UDP stream, when the app has a real-time target
+        stream = st.session_state.result.get("realtime") if "result" in st.session_state else None
+        if stream:
+            st.markdown(f"### 📞 Real-Time Quality — MOS {stream['mos']:.1f}")
+            loss_col, burst_col, reorder_col = st.columns(3)
+            loss_col.metric("Packet loss", f"{stream['loss']:.1%}",
+                            help=f"{stream['sent'] - stream['received']} of {stream['sent']} packets")
+            burst_col.metric("Longest loss burst", f"{stream['max_burst']} packets",
+                             help=f"{stream['bursts']} bursts, burst ratio {stream['burst_ratio']:.2f}")
+            reorder_col.metric("Reordered", f"{stream['reordered']:.1%}",
+                               help=f"R-factor {stream['r_factor']:.0f}")
             
     # Network Suitability Analyzer with improved grid layout
-    with analysis_container:
+    with analysis_container, page_tracer.span("analysis"):
         st.markdown("## 🔍 Network Suitability Analyzer")
         
-        def get_status(category, thresholds, inverse=False):
-            """
-            Get status based on thresholds
-            inverse=True means lower values are better (for ping and jitter)
-            """
-            if category == "download":
-                value = st.session_state.download
-            elif category == "upload":
-                value = st.session_state.upload
-            elif category == "ping":
-                value = st.session_state.ping
-            elif category == "jitter":
-                value = st.session_state.jitter
-            else:
-                return "unknown"
-                
-            if inverse:
-                # For inverse metrics (ping, jitter) - lower is better
-                if value <= thresholds[0]:
-                    return "good"
-                elif value <= thresholds[1]:
-                    return "moderate"
-                else:
-                    return "bad"
-            else:
-                # For regular metrics (download, upload) - higher is better
-                if value >= thresholds[0]:
-                    return "good"
-                elif value >= thresholds[1]:
-                    return "moderate"
-                else:
-                    return "bad"
+        # Evaluate every use case against the stored result
+        result = st.session_state.get("result", {})
+        measured = tuple((metric, result.get(metric, st.session_state.get(metric))) for metric in METRICS)
         
-        def create_use_case_card(title, icon, category_checks, good_msg, mod_msg, bad_msg):
-            status = "good"
-            
-            # Check all the requirements
-            for cat, thresholds in category_checks.items():
-                inverse = cat in ["ping", "jitter"]  # Ping and jitter are inverse metrics
-                cat_status = get_status(cat, thresholds, inverse)
-                if cat_status == "bad":
-                    status = "bad"
-                    break
-                elif cat_status == "moderate" and status != "bad":
-                    status = "moderate"
-            
-            # Determine styling and message
-            if status == "good":
-                color = "#00FF00"
-                emoji = "✅"
-                message = good_msg
-                bg_color = "rgba(0, 100, 0, 0.3)"
-            elif status == "moderate":
-                color = "#FFAA00"
-                emoji = "⚠️"
-                message = mod_msg
-                bg_color = "rgba(100, 70, 0, 0.3)"
-            else:
-                color = "#FF0000"
-                emoji = "❌"
-                message = bad_msg
-                bg_color = "rgba(100, 0, 0, 0.3)"
-                
-            return f"""
-                <div class="use-case-card" style="background: {bg_color};">
-                    <div class="use-case-title">
-                        {icon} {title} {emoji}
-                    </div>
-                    <div class="use-case-body">
-                        {message}
-                    </div>
-                </div>
-            """
-        
-        # Define the use cases in a 3x3 grid
-        # Note: For ping and jitter, the thresholds work in reverse (lower is better)
-        use_cases = [
-            {
-                "title": "Video Streaming",
-                "icon": "📺",
-                "checks": {"download": [25, 10]},
-                "good_msg": "Excellent! 4K HDR content will stream fluidly.",
-                "mod_msg": "Suitable for 720p-1080p. Multiple users may experience buffering.",
-                "bad_msg": "Too slow for smooth video playback. Expect frequent buffering."
-            },
-            {
-                "title": "Gaming / AR-VR",
-                "icon": "🎮",
-                "checks": {"ping": [30, 80], "jitter": [5, 15]},
-                "good_msg": "Perfect for competitive gaming and real-time VR applications.",
-                "mod_msg": "Acceptable for casual games but may experience occasional lag in fast-paced titles.",
-                "bad_msg": "High latency will cause significant lag in most games and VR apps."
-            },
-            {
-                "title": "Video Calls",
-                "icon": "🎥",
-                "checks": {"upload": [5, 2], "download": [5, 2]},
-                "good_msg": "Crisp HD video calls with multiple participants supported.",
-                "mod_msg": "Standard definition calls possible with occasional quality drops.",
-                "bad_msg": "Likely to experience freezing, pixelation and audio issues."
-            },
-            {
-                "title": "Industry 4.0 / IoT",
-                "icon": "🏭",
-                "checks": {"ping": [20, 50], "upload": [10, 5], "jitter": [3, 10]},
-                "good_msg": "Ideal for industrial automation and real-time cloud sync.",
-                "mod_msg": "Usable for basic industrial applications with modest data needs.",
-                "bad_msg": "Too unreliable for critical industrial applications."
-            },
-            {
-                "title": "Banking / Transactions",
-                "icon": "🏦",
-                "checks": {"ping": [80, 150], "jitter": [10, 20]},
-                "good_msg": "Fast and responsive for secure financial transactions.",
-                "mod_msg": "Transactions will work but with slight delays.",
-                "bad_msg": "Connection may time out during sensitive operations."
-            },
-            {
-                "title": "Healthcare / Telemedicine",
-                "icon": "🏥",
-                "checks": {"download": [15, 5], "upload": [3, 1], "ping": [50, 100], "jitter": [5, 15]},
-                "good_msg": "Perfect for telemedicine consultations and medical image sharing.",
-                "mod_msg": "Basic telemedicine possible but image quality may be reduced.",
-                "bad_msg": "Not reliable enough for critical healthcare applications."
-            },
-            {
-                "title": "Smart City Infrastructure",
-                "icon": "🌆",
-                "checks": {"upload": [10, 3], "ping": [30, 80], "jitter": [5, 15]},
-                "good_msg": "Excellent for smart city sensors, traffic management and public safety systems.",
-                "mod_msg": "Can support basic smart city functions with limited real-time capabilities.",
-                "bad_msg": "Too unstable for reliable smart city infrastructure."
-            },
-            {
-                "title": "Research & Data Science",
-                "icon": "🔬",
-                "checks": {"download": [50, 20], "upload": [20, 10]},
-                "good_msg": "Perfect for cloud computing, large dataset transfers and collaborative research.",
-                "mod_msg": "Usable for moderate research needs but large data transfers will be slow.",
-                "bad_msg": "Data-intensive research will be significantly hampered."
-            },
-            {
-                "title": "Remote Work",
-                "icon": "💼",
-                "checks": {"download": [15, 5], "upload": [5, 2], "ping": [100, 200], "jitter": [10, 20]},
-                "good_msg": "Excellent for all remote work needs including collaborative tools.",
-                "mod_msg": "Suitable for basic remote work but may struggle with video meetings.",
-                "bad_msg": "Remote work will be challenging with frequent connectivity issues."
-            }
-        ]
-        
-        # Create the grid
         st.markdown("<h3 style='text-align:center;'>🧠 Use Case Analysis</h3>", unsafe_allow_html=True)
-        
-        # Display in rows of 3
-        for i in range(0, len(use_cases), 3):
-            cols = st.columns(3)
-            for j in range(3):
-                if i+j < len(use_cases):
-                    case = use_cases[i+j]
-                    cols[j].markdown(
-                        create_use_case_card(
-                            case["title"], 
-                            case["icon"], 
-                            case["checks"],
-                            case["good_msg"],
-                            case["mod_msg"],
-                            case["bad_msg"]
-                        ), 
-                        unsafe_allow_html=True
-                    )
+        st.markdown(use_case_grid(measured, get_plan().revision), unsafe_allow_html=True)
     
-    # Enhanced suggestions
+    # Enhanced suggestions, built only once asked for
     with suggestions_container:
         st.markdown("## 💡 Personalized Improvement Suggestions")
-        
-        suggestions = []
-        
-        # Add download speed suggestions
-        if st.session_state.download < 10:
-            suggestions.append({
-                "icon": "🔽",
-                "title": "Critically Low Download Speed",
-                "content": "Your download speed is severely limiting your online activities. Consider upgrading to at least a 50 Mbps plan for general use, or 100+ Mbps for households with multiple users."
-            })
-        elif st.session_state.download < 25:
-            suggestions.append({
-                "icon": "🔽",
-                "title": "Low Download Speed",
-                "content": "Your download speed may limit streaming quality and large file downloads. Consider upgrading your plan or checking for network interference."
-            })
-            
-        # Add upload speed suggestions
-        if st.session_state.upload < 2:
-            suggestions.append({
-                "icon": "🔼",
-                "title": "Critically Low Upload Speed",
-                "content": "Your upload speed will severely impact video calls, file sharing, and cloud backups. Contact your ISP about asymmetric connection options or business-grade plans with better upload speeds."
-            })
-        elif st.session_state.upload < 5:
-            suggestions.append({
-                "icon": "🔼",
-                "title": "Low Upload Speed",
-                "content": "Your upload speed may impact video conferencing and file sharing. Consider a plan with better upload capacity if you frequently use these services."
-            })
-            
-        # Add latency suggestions
-        if st.session_state.ping > 100:
-            suggestions.append({
-                "icon": "⏱️",
-                "title": "High Latency Detected",
-                "content": "Your high ping will impact gaming, video calls, and real-time applications. Try using a wired Ethernet connection instead of WiFi, and ensure no other bandwidth-heavy applications are running."
-            })
-            
-        # Add jitter suggestions
-        if st.session_state.jitter > 10:
-            suggestions.append({
-                "icon": "📶",
-                "title": "Connection Instability",
-                "content": "Your connection shows significant jitter (variation in ping), which can cause unstable performance even with good speeds. Check for interference sources, outdated router firmware, or try a mesh WiFi system for better coverage."
-            })
-            
-        # Add general suggestions
-        suggestions.append({
-            "icon": "🛠️",
-            "title": "Connection Optimization",
-            "content": "For best performance: (1) Use wired connections for stationary devices, (2) Place your router in a central, elevated location, (3) Use 5GHz WiFi for devices that support it, (4) Regularly restart your modem and router."
-        })
-        
-        suggestions.append({
-            "icon": "📱",
-            "title": "Device Optimization",
-            "content": "Ensure your devices are updated with the latest firmware and drivers. Close background applications that may be consuming bandwidth. Consider upgrading older devices that may have limited WiFi capabilities."
-        })
-        
-        # Display suggestions in a 2-column grid
-        cols = st.columns(2)
-        for i, suggestion in enumerate(suggestions):
-            col_idx = i % 2
-            with cols[col_idx]:
-                st.markdown(f"""
-                    <div style="background: rgba(0, 60, 120, 0.3); border-radius: 10px; padding: 15px; margin-bottom: 15px; border-left: 4px solid #00FFFF;">
-                        <h4 style="color: #00FFFF; margin-top: 0;">{suggestion['icon']} {suggestion['title']}</h4>
-                        <p style="margin-bottom: 0;">{suggestion['content']}</p>
-                    </div>
-                """, unsafe_allow_html=True)
+        if st.toggle("Show suggestions", key="show_suggestions"):
+            with page_tracer.span("suggestions"):
+                st.markdown(suggestion_grid(measured, get_plan().revision), unsafe_allow_html=True)
+
+# Below-the-fold sections only run while their toggle is on; an expander's
+# body would still run, and cost, on every rerun
+if st.toggle("📜 Test History", key="show_history"):
+    with st.container(border=True), page_tracer.span("history"):
+        store = get_history_store()
+        servers = [row["server_host"] for row in store.servers()]
+        col1, col2 = st.columns(2)
+        with col1:
+            today = datetime.now(timezone.utc).date()
+            date_range = st.date_input("Date range (UTC)", value=(today - timedelta(days=30), today))
+        with col2:
+            server_choice = st.selectbox("Server", ["All servers"] + servers)
+
+        if isinstance(date_range, (tuple, list)) and len(date_range) == 2:
+            start = datetime.combine(date_range[0], dt_time.min, tzinfo=timezone.utc)
+            end = datetime.combine(date_range[1] + timedelta(days=1), dt_time.min, tzinfo=timezone.utc)
+            # Only the summary columns of the selected range are read, never the raw samples
+            history = {"time": [], "download": [], "upload": [], "ping": [], "jitter": []}
+            for run in store.query(start=start, end=end,
+                                   server=None if server_choice == "All servers" else server_choice):
+                history["time"].append(datetime.fromtimestamp(run["timestamp"], timezone.utc))
+                for key in ("download", "upload", "ping", "jitter"):
+                    history[key].append(run[key])
+
+            if history["time"]:
+                st.caption(f"{len(history['time'])} runs")
+                st.markdown("**Speed (Mbps)**")
+                st.line_chart({"time": history["time"], "download": history["download"],
+                               "upload": history["upload"]}, x="time")
+                st.markdown("**Latency (ms)**")
+                st.line_chart({"time": history["time"], "ping": history["ping"],
+                               "jitter": history["jitter"]}, x="time")
+            else:
+                st.info("No runs recorded in this range yet.")
+
+# Fleet dashboard, read from the rollups `cryos ingest` maintains
+fleet_store = get_fleet_store()
+if fleet_store is not None and st.toggle("🛰️ Fleet Dashboard", key="show_fleet"):
+    with st.container(border=True), page_tracer.span("fleet"):
+        col1, col2 = st.columns(2)
+        with col1:
+            today = datetime.now(timezone.utc).date()
+            fleet_range = st.date_input("Date range (UTC)", value=(today - timedelta(days=7), today),
+                                        key="fleet_range")
+        with col2:
+            period = st.radio("Rollup", ["hour", "day"], index=1, horizontal=True)
+
+        if isinstance(fleet_range, (tuple, list)) and len(fleet_range) == 2:
+            start = datetime.combine(fleet_range[0], dt_time.min, tzinfo=timezone.utc)
+            end = datetime.combine(fleet_range[1] + timedelta(days=1), dt_time.min, tzinfo=timezone.utc)
+            rollups = fleet_store.rollups(period, start, end)
+            if rollups:
+                # Share of good runs per site and use case, marked with the
+                # worst status any of its runs had
+                status_icons = {"good": "✅", "moderate": "⚠️", "bad": "❌", "unknown": "❔"}
+                severity = ("bad", "moderate", "unknown", "good")
+                table = []
+                for site, cases in sorted(fleet_store.suitability(period, start, end).items()):
+                    row = {"site": site}
+                    for title, counts in cases.items():
+                        runs = sum(counts.values())
+                        worst = next((status for status in severity if counts.get(status)),
+                                     max(counts, key=counts.get))
+                        row[title] = f"{status_icons.get(worst, '')} {counts.get('good', 0) / runs:.0%} good"
+                    table.append(row)
+                st.markdown("**Suitability by site**")
+                st.dataframe(table, hide_index=True, use_container_width=True)
+
+                # One row per bucket and one column per site
+                buckets = sorted({row["bucket"] for row in rollups})
+                sites = sorted({row["site"] for row in rollups})
+                position = {bucket: i for i, bucket in enumerate(buckets)}
+                for metric, label in (("download", "Download (Mbps)"), ("ping", "Ping (ms)")):
+                    chart = {"time": [datetime.fromtimestamp(bucket, timezone.utc) for bucket in buckets]}
+                    for site in sites:
+                        chart[site] = [None] * len(buckets)
+                    for row in rollups:
+                        chart[row["site"]][position[row["bucket"]]] = row[metric]
+                    st.markdown(f"**{label}, {period}ly mean**")
+                    st.line_chart(chart, x="time")
+            else:
+                st.info("No fleet results in this range yet.")
 
 # Meet the Creators with improved styling
 st.markdown("## 👨‍💻 Meet the Creators of Cryos")
 
-creator_col1, creator_col2 = st.columns(2)
+if st.toggle("Show creators", key="show_creators"):
+    creator_col1, creator_col2 = st.columns(2)
 
-with creator_col1:
-    st.markdown("""
-        <div style="background: rgba(0, 30, 60, 0.7); border-radius: 15px; padding: 20px; height: 100%; border: 1px solid rgba(0, 255, 255, 0.3);">
-            <h3 style="margin-top: 0;">🌌 Saksham Anand</h3>
-            <p>A tech enthusiast passionate about building innovative digital experiences that enhance everyday connectivity.</p>
-            <div style="display: flex; gap: 10px;">
-                <a href="https://github.com/SakshamAnand/" style="text-decoration: none; color: #00FFFF;">🔗 GitHub</a>
-                <a href="https://www.linkedin.com/in/saksham-anand05/" style="text-decoration: none; color: #00FFFF;">🔗 LinkedIn</a>
+    with creator_col1:
+        st.markdown("""
+            <div style="background: rgba(0, 30, 60, 0.7); border-radius: 15px; padding: 20px; height: 100%; border: 1px solid rgba(0, 255, 255, 0.3);">
+                <h3 style="margin-top: 0;">🌌 Saksham Anand</h3>
+                <p>A tech enthusiast passionate about building innovative digital experiences that enhance everyday connectivity.</p>
+                <div style="display: flex; gap: 10px;">
+                    <a href="https://github.com/SakshamAnand/" style="text-decoration: none; color: #00FFFF;">🔗 GitHub</a>
+                    <a href="https://www.linkedin.com/in/saksham-anand05/" style="text-decoration: none; color: #00FFFF;">🔗 LinkedIn</a>
+                </div>
             </div>
-        </div>
-    """, unsafe_allow_html=True)
+        """, unsafe_allow_html=True)
 
 
 # Enhanced footer
@@ -698,3 +622,26 @@ st.markdown("""
         <p style="margin: 0; font-size: 12px; opacity: 0.7;">Empowering the world with better connectivity insights.</p>
     </div>
 """, unsafe_allow_html=True)
+
+rerun_span.finish()
+if PROFILE:
+    with st.expander("⏱️ Run timings"):
+        timings = [page_tracer.to_dict()]
+        test_timings = st.session_state.result.get("timings") if "result" in st.session_state else None
+        if test_timings:
+            timings.insert(0, test_timings)
+            st.markdown("**Last test**")
+            st.dataframe(test_timings["spans"], use_container_width=True)
+        st.markdown("**This page run**")
+        st.dataframe(timings[-1]["spans"], use_container_width=True)
+        json_col, trace_col = st.columns(2)
+        json_col.download_button("Download JSON", json.dumps(timings), file_name="cryos-timings.json",
+                                 mime="application/json")
+        trace_col.download_button("Download Chrome trace", json.dumps(chrome_trace(*timings)),
+                                  file_name="cryos-trace.json", mime="application/json",
+                                  help="Open in chrome://tracing or ui.perfetto.dev")
+
+# Poll a running test: render the page, then rerun once the job has moved on
+if polling:
+    time.sleep(POLL_INTERVAL)
+    st.rerun()